@@ -0,0 +1,70 @@
+"""Compare how long a page of posts takes to turn into JSON bytes: the
+FastAPI way (validate the rows into response models from attributes, then
+dump them) against the direct row-to-JSON path of socialapi.serialization.
+
+Run from the repository root with the app's environment configured:
+
+    python -m benchmarks.serialization [rows] [repeat]
+"""
+import sys
+import timeit
+
+from pydantic import TypeAdapter
+
+from socialapi.models import UserPostWithLikes
+from socialapi.serialization import model_fields, rows_to_json
+
+
+class FakeRecord:
+    """Stands in for a databases Record: attribute access for pydantic,
+    _mapping for the direct path."""
+
+    def __init__(self, mapping: dict) -> None:
+        self._mapping = mapping
+
+    def __getattr__(self, name: str):
+        try:
+            return self._mapping[name]
+        except KeyError as e:
+            raise AttributeError(name) from e
+
+
+def make_rows(count: int) -> list[FakeRecord]:
+    return [
+        FakeRecord({
+            "id": i,
+            "body": f"Post number {i} with a body of a realistic length for a social feed",
+            "user_id": i % 97,
+            "image_url": None if i % 3 else f"https://example.net/{i}.jpg",
+            "likes": i * 7 % 1000,
+        })
+        for i in range(count)
+    ]
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    rows = make_rows(count)
+    adapter = TypeAdapter(list[UserPostWithLikes])
+
+    def through_models() -> bytes:
+        return adapter.dump_json(adapter.validate_python(rows, from_attributes=True))
+
+    def direct() -> bytes:
+        return rows_to_json(rows, model_fields(UserPostWithLikes))
+
+    assert adapter.validate_json(through_models()) == adapter.validate_json(direct())
+
+    results = {}
+    for name, function in (("models", through_models), ("direct", direct)):
+        best = min(timeit.repeat(function, number=repeat, repeat=5)) / repeat
+        results[name] = best
+        print(f"{name:>6}: {best * 1e6:9.1f} us per page of {count} posts")
+
+    print(f"speedup: {results['models'] / results['direct']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Compare what reading the subject of an access token costs per request:
+a full jwt.decode, as every request used to pay, against a request
+presenting a token already in socialapi.security.token_cache.
+
+Run from the repository root with the app's environment configured:
+
+    python -m benchmarks.tokens [repeat]
+"""
+import sys
+import timeit
+
+from jose import jwt
+
+from socialapi.config import config
+from socialapi.security import create_access_token, get_subject_for_token_type, token_cache
+
+
+def main() -> None:
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    token = create_access_token("benchmark@example.net")
+
+    def decode() -> str:
+        return jwt.decode(token, key=config.JWT_SECRET_KEY, algorithms=[config.JWT_ALGORITHM])["sub"]
+
+    def cached() -> str:
+        return get_subject_for_token_type(token, "access")
+
+    assert decode() == cached()
+
+    results = {}
+    for name, function in (("decode", decode), ("cached", cached)):
+        best = min(timeit.repeat(function, number=repeat, repeat=5)) / repeat
+        results[name] = best
+        print(f"{name:>6}: {best * 1e6:7.2f} us per request")
+
+    print(f"speedup: {results['decode'] / results['cached']:.1f}x")
+    print(f"cache: {token_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""index refresh tokens expires_at
+
+Revision ID: 2f8c4a6d1e93
+Revises: 9b3e6f1a8d42
+Create Date: 2026-10-18 19:44:31.512806
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2f8c4a6d1e93'
+down_revision: Union[str, None] = '9b3e6f1a8d42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_refresh_tokens_expires_at', 'refresh_tokens', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_refresh_tokens_expires_at', table_name='refresh_tokens')
@@ -0,0 +1,26 @@
+"""index comments by post
+
+Revision ID: 3af9dcc36079
+Revises: b0e1b6b7cd11
+Create Date: 2026-10-18 13:15:48.640092
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3af9dcc36079'
+down_revision: Union[str, None] = 'b0e1b6b7cd11'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_comments_post_id_id', 'comments', ['post_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_comments_post_id_id', table_name='comments')
@@ -0,0 +1,43 @@
+"""unique likes per user
+
+Revision ID: 450e58e2afd5
+Revises: bc172fc03321
+Create Date: 2026-10-18 11:24:37.902115
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '450e58e2afd5'
+down_revision: Union[str, None] = 'bc172fc03321'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keep the oldest like of every (post, user) pair and recount the posts
+    # whose duplicates were removed before the constraint goes in.
+    op.execute(
+        """
+        DELETE FROM likes
+        USING likes AS kept
+        WHERE likes.post_id = kept.post_id
+          AND likes.user_id = kept.user_id
+          AND likes.id > kept.id
+        """
+    )
+    op.execute(
+        """
+        UPDATE posts
+        SET like_count = (SELECT count(*) FROM likes WHERE likes.post_id = posts.id)
+        """
+    )
+    op.create_unique_constraint('uq_likes_post_id_user_id', 'likes', ['post_id', 'user_id'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_likes_post_id_user_id', 'likes', type_='unique')
@@ -0,0 +1,41 @@
+"""add search vector to posts
+
+Revision ID: 5c0e9d7a3b21
+Revises: 7daf9af1c4b2
+Create Date: 2026-10-18 14:31:07.402518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c0e9d7a3b21'
+down_revision: Union[str, None] = '7daf9af1c4b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # A stored generated column rewrites the table once; after that Postgres
+    # keeps it in step with body on every insert and update.
+    op.add_column(
+        'posts',
+        sa.Column(
+            'search_vector',
+            postgresql.TSVECTOR(),
+            sa.Computed("to_tsvector('english', coalesce(body, ''))", persisted=True),
+            nullable=True
+        )
+    )
+    with op.get_context().autocommit_block():
+        op.create_index('ix_posts_search_vector', 'posts', ['search_vector'], unique=False, postgresql_using='gin', postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_posts_search_vector', table_name='posts', postgresql_concurrently=True, if_exists=True)
+    op.drop_column('posts', 'search_vector')
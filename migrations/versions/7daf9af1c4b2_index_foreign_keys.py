@@ -0,0 +1,35 @@
+"""index foreign keys
+
+Revision ID: 7daf9af1c4b2
+Revises: 3af9dcc36079
+Create Date: 2026-10-18 13:52:20.118764
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7daf9af1c4b2'
+down_revision: Union[str, None] = '3af9dcc36079'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# CREATE INDEX CONCURRENTLY cannot run inside a transaction, hence the
+# autocommit blocks; if_not_exists lets a run interrupted half way (which
+# leaves an invalid index behind that must be dropped first) be retried.
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_posts_user_id_id', 'posts', ['user_id', 'id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_comments_user_id', 'comments', ['user_id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_likes_user_id', 'likes', ['user_id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_likes_user_id', table_name='likes', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_comments_user_id', table_name='comments', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_posts_user_id_id', table_name='posts', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,42 @@
+"""refresh tokens
+
+Revision ID: 9b3e6f1a8d42
+Revises: e41f7c2d9a06
+Create Date: 2026-10-18 17:21:09.304117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b3e6f1a8d42'
+down_revision: Union[str, None] = 'e41f7c2d9a06'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'refresh_tokens',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('token_hash', sa.String(), nullable=False),
+        sa.Column('family_id', sa.String(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('used_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('revoked', sa.Boolean(), server_default=sa.text('false'), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('token_hash')
+    )
+    op.create_index('ix_refresh_tokens_family_id', 'refresh_tokens', ['family_id'], unique=False)
+    op.create_index('ix_refresh_tokens_user_id', 'refresh_tokens', ['user_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_refresh_tokens_user_id', table_name='refresh_tokens')
+    op.drop_index('ix_refresh_tokens_family_id', table_name='refresh_tokens')
+    op.drop_table('refresh_tokens')
@@ -0,0 +1,35 @@
+"""add version to posts
+
+Revision ID: b0e1b6b7cd11
+Revises: 450e58e2afd5
+Create Date: 2026-10-18 12:41:05.227319
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b0e1b6b7cd11'
+down_revision: Union[str, None] = '450e58e2afd5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(sa.schema.CreateSequence(sa.Sequence('posts_version_seq')))
+    # Adding the column with a volatile default gives every existing post
+    # its own version.
+    op.add_column(
+        'posts',
+        sa.Column('version', sa.BigInteger(), server_default=sa.text("nextval('posts_version_seq')"), nullable=False)
+    )
+    op.create_index('ix_posts_version', 'posts', ['version'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_posts_version', table_name='posts')
+    op.drop_column('posts', 'version')
+    op.execute(sa.schema.DropSequence(sa.Sequence('posts_version_seq')))
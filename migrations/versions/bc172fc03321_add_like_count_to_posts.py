@@ -0,0 +1,36 @@
+"""add like_count to posts
+
+Revision ID: bc172fc03321
+Revises: be38a7b03f46
+Create Date: 2026-10-18 10:02:11.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'bc172fc03321'
+down_revision: Union[str, None] = 'be38a7b03f46'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('posts', sa.Column('like_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        """
+        UPDATE posts
+        SET like_count = counted.likes
+        FROM (SELECT post_id, count(*) AS likes FROM likes GROUP BY post_id) AS counted
+        WHERE posts.id = counted.post_id
+        """
+    )
+    op.create_index('ix_posts_like_count_id', 'posts', ['like_count', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_posts_like_count_id', table_name='posts')
+    op.drop_column('posts', 'like_count')
@@ -0,0 +1,48 @@
+"""follows and timelines
+
+Revision ID: e41f7c2d9a06
+Revises: 5c0e9d7a3b21
+Create Date: 2026-10-18 15:02:44.918311
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41f7c2d9a06'
+down_revision: Union[str, None] = '5c0e9d7a3b21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('follower_count', sa.Integer(), server_default='0', nullable=False))
+    op.create_index('ix_users_follower_count', 'users', ['follower_count'], unique=False)
+    op.create_table(
+        'follows',
+        sa.Column('follower_id', sa.Integer(), nullable=False),
+        sa.Column('followee_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['followee_id'], ['users.id'], ),
+        sa.ForeignKeyConstraint(['follower_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('follower_id', 'followee_id')
+    )
+    op.create_index('ix_follows_followee_id_follower_id', 'follows', ['followee_id', 'follower_id'], unique=False)
+    op.create_table(
+        'timelines',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('user_id', 'post_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('timelines')
+    op.drop_index('ix_follows_followee_id_follower_id', table_name='follows')
+    op.drop_table('follows')
+    op.drop_index('ix_users_follower_count', table_name='users')
+    op.drop_column('users', 'follower_count')
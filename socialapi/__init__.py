@@ -1,3 +1,3 @@
-from .models import UserPost, UserPostIn, CommentIn, Comment, UserPostWithComments, User, UserIn, PostLike, PostLikeIn, UserPostWithLikes
+from .models import UserPost, UserPostIn, CommentIn, Comment, UserPostWithComments, UserPostBatch, User, UserIn, RefreshTokenIn, PostLike, PostLikeIn, LikeAccepted, UserPostWithLikes
 from .routers import post_router, user_router, upload_router
 from .main import app
\ No newline at end of file
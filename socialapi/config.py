@@ -28,6 +28,52 @@ class GlobalConfig(BaseConfig):
     B2_APPLICATION_KEY: Optional[str] = None
     B2_BUCKET_NAME: Optional[str] = None
     DEEPAI_API_KEY: Optional[str] = None
+    ACCESS_TOKEN_EXPIRE_MINUTES: int = 5
+    CONFIRM_TOKEN_EXPIRE_MINUTES: int = 5
+    REFRESH_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 30
+    REFRESH_TOKEN_PRUNE_SECONDS: float = 3600
+    MOST_LIKED_RECONCILE_SECONDS: float = 300
+    # Comma separated connection strings of read replicas
+    REPLICA_URLS: Optional[str] = None
+    READ_YOUR_WRITES_SECONDS: float = 5
+    # Posts of accounts with more followers are not copied into timelines;
+    # readers pull them in when reading their timeline instead. Copying
+    # runs after the response: a post whose worker dies before then stays
+    # out of its followers' timelines until they follow its author again.
+    TIMELINE_FANOUT_MAX_FOLLOWERS: int = 10000
+    # Recent posts copied into a timeline when following an account
+    TIMELINE_BACKFILL_POSTS: int = 50
+    # Write-behind buffering of likes, see like_buffer.py
+    LIKE_BUFFER_ENABLED: bool = False
+    LIKE_BUFFER_FLUSH_SECONDS: float = 1
+    LIKE_BUFFER_MAX_SIZE: int = 1000
+    # Events a slow GET /posts/events client may fall behind before missing some
+    EVENTS_QUEUE_SIZE: int = 100
+    EVENTS_KEEPALIVE_SECONDS: float = 15
+    # Cost of new password hashes; stored hashes of another cost are
+    # rehashed on login
+    BCRYPT_ROUNDS: int = 12
+    # Passwords hashed or checked at once, the others wait their turn
+    BCRYPT_MAX_WORKERS: int = 4
+    # Login attempts allowed per account and per client address: a burst,
+    # then so many a minute. See rate_limit.py
+    LOGIN_EMAIL_BURST: int = 10
+    LOGIN_EMAIL_PER_MINUTE: float = 5
+    LOGIN_IP_BURST: int = 30
+    LOGIN_IP_PER_MINUTE: float = 30
+    RATE_LIMIT_MAX_KEYS: int = 100000
+    # Trust the user id and confirmation state carried by access tokens
+    # instead of reading the user on every request. A change to the user
+    # then goes unnoticed until the token expires.
+    AUTH_CLAIMS_ONLY: bool = False
+    # How often the counters of password hashing and of the user and token
+    # caches are logged
+    AUTH_STATS_LOG_SECONDS: float = 60
+    # Confirmed users looked up by get_current_user, see security.py
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_TTL_SECONDS: float = 30
+    # Tokens whose signature was already checked, kept until they expire
+    TOKEN_CACHE_SIZE: int = 10000
 
 class DevConfig(GlobalConfig):
     model_config = SettingsConfigDict(env_prefix="DEV_", extra="ignore")
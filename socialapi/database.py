@@ -1,18 +1,43 @@
+import itertools
+import time
+from contextvars import ContextVar
+from typing import Optional
+
 import databases
 import sqlalchemy
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from .config import config
 
 connection_string = f"postgresql://{config.USER}:{config.PASSWORD}@{config.ADDRESS}:{config.PORT}/{config.DATABASE}"
 
 metadata = sqlalchemy.MetaData()
 
+# Text search configuration of posts.search_vector; queries against the
+# column must use the same one for the GIN index to apply.
+SEARCH_CONFIG = "english"
+
+# Every write that changes how a post is rendered stamps it with the next
+# value of this sequence; it backs the ETags of the post endpoints.
+post_version_seq = sqlalchemy.Sequence("posts_version_seq", metadata=metadata)
+
 post_table = sqlalchemy.Table(
     "posts",
     metadata,
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
     sqlalchemy.Column("body", sqlalchemy.String),
     sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
-    sqlalchemy.Column("image_url", sqlalchemy.String)
+    sqlalchemy.Column("image_url", sqlalchemy.String),
+    sqlalchemy.Column("like_count", sqlalchemy.Integer, nullable=False, server_default="0"),
+    sqlalchemy.Column("version", sqlalchemy.BigInteger, nullable=False, server_default=sqlalchemy.text("nextval('posts_version_seq')")),
+    sqlalchemy.Column(
+        "search_vector",
+        TSVECTOR,
+        sqlalchemy.Computed(f"to_tsvector('{SEARCH_CONFIG}', coalesce(body, ''))", persisted=True)
+    ),
+    sqlalchemy.Index("ix_posts_like_count_id", "like_count", "id"),
+    sqlalchemy.Index("ix_posts_version", "version"),
+    sqlalchemy.Index("ix_posts_user_id_id", "user_id", "id"),
+    sqlalchemy.Index("ix_posts_search_vector", "search_vector", postgresql_using="gin")
 )
 
 comments_table = sqlalchemy.Table(
@@ -21,7 +46,9 @@ comments_table = sqlalchemy.Table(
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
     sqlalchemy.Column("body", sqlalchemy.String),
     sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), nullable=False),
-    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False)
+    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
+    sqlalchemy.Index("ix_comments_post_id_id", "post_id", "id"),
+    sqlalchemy.Index("ix_comments_user_id", "user_id")
 )
 
 like_table = sqlalchemy.Table(
@@ -30,6 +57,8 @@ like_table = sqlalchemy.Table(
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
     sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), nullable=False),
     sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
+    sqlalchemy.UniqueConstraint("post_id", "user_id", name="uq_likes_post_id_user_id"),
+    sqlalchemy.Index("ix_likes_user_id", "user_id")
 )
 
 users_table = sqlalchemy.Table(
@@ -38,7 +67,43 @@ users_table = sqlalchemy.Table(
     sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
     sqlalchemy.Column("email", sqlalchemy.String, unique=True, nullable=False),
     sqlalchemy.Column("password", sqlalchemy.String, nullable=False),
-    sqlalchemy.Column("confirmed", sqlalchemy.Boolean, nullable=False, server_default=sqlalchemy.sql.expression.false(), default=sqlalchemy.sql.expression.false())
+    sqlalchemy.Column("confirmed", sqlalchemy.Boolean, nullable=False, server_default=sqlalchemy.sql.expression.false(), default=sqlalchemy.sql.expression.false()),
+    sqlalchemy.Column("follower_count", sqlalchemy.Integer, nullable=False, server_default="0"),
+    sqlalchemy.Index("ix_users_follower_count", "follower_count")
+)
+
+follows_table = sqlalchemy.Table(
+    "follows",
+    metadata,
+    sqlalchemy.Column("follower_id", sqlalchemy.ForeignKey("users.id"), primary_key=True),
+    sqlalchemy.Column("followee_id", sqlalchemy.ForeignKey("users.id"), primary_key=True),
+    sqlalchemy.Index("ix_follows_followee_id_follower_id", "followee_id", "follower_id")
+)
+
+# Home timelines precomputed on write: one row per post a user should see
+# from the accounts they follow, read newest first by primary key.
+timelines_table = sqlalchemy.Table(
+    "timelines",
+    metadata,
+    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), primary_key=True),
+    sqlalchemy.Column("post_id", sqlalchemy.ForeignKey("posts.id"), primary_key=True)
+)
+
+# Only a digest of each refresh token is kept. Every rotation adds a row
+# to the family started at login; a token used twice revokes its family.
+refresh_tokens_table = sqlalchemy.Table(
+    "refresh_tokens",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("token_hash", sqlalchemy.String, unique=True, nullable=False),
+    sqlalchemy.Column("family_id", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("user_id", sqlalchemy.ForeignKey("users.id"), nullable=False),
+    sqlalchemy.Column("expires_at", sqlalchemy.DateTime(timezone=True), nullable=False),
+    sqlalchemy.Column("used_at", sqlalchemy.DateTime(timezone=True)),
+    sqlalchemy.Column("revoked", sqlalchemy.Boolean, nullable=False, server_default=sqlalchemy.sql.expression.false()),
+    sqlalchemy.Index("ix_refresh_tokens_family_id", "family_id"),
+    sqlalchemy.Index("ix_refresh_tokens_user_id", "user_id"),
+    sqlalchemy.Index("ix_refresh_tokens_expires_at", "expires_at")
 )
 
 engine = sqlalchemy.create_engine(
@@ -51,3 +116,28 @@ database = databases.Database(
     url=connection_string,
     force_rollback=config.DB_FORCE_ROLL_BACK
 )
+
+replica_databases = [
+    databases.Database(url=url.strip())
+    for url in (config.REPLICA_URLS or "").split(",")
+    if url.strip()
+]
+_replica_counter = itertools.count()
+
+# Unix time of the current client's last write, taken from its cookie by
+# the read-your-writes middleware in main.py.
+last_write_at: ContextVar[Optional[float]] = ContextVar("last_write_at", default=None)
+
+
+def get_read_database() -> databases.Database:
+    """Database for read-only queries: the replicas in turn, unless none
+    are configured or the client wrote less than READ_YOUR_WRITES_SECONDS
+    ago and must see its own write."""
+    if not replica_databases:
+        return database
+
+    written = last_write_at.get()
+    if written is not None and time.time() - written < config.READ_YOUR_WRITES_SECONDS:
+        return database
+
+    return replica_databases[next(_replica_counter) % len(replica_databases)]
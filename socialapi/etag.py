@@ -0,0 +1,25 @@
+from typing import Optional
+
+from fastapi import Response, status
+
+
+def make_etag(*parts) -> str:
+    """Weak ETag built from a resource name and its version."""
+    return 'W/"%s"' % "-".join(str(part) for part in parts)
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Weak comparison of an If-None-Match header against our ETag. Without
+    an ETag, when there is no such resource, nothing matches, * included."""
+    if not if_none_match or etag is None:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    candidates = {candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import logging
+from contextlib import contextmanager, suppress
+from typing import Iterator, Optional
+
+import asyncpg
+import sqlalchemy
+
+from .config import config
+
+
+logger = logging.getLogger(__name__)
+
+EVENTS_CHANNEL = "post_events"
+# Waits between attempts to listen again after losing the connection,
+# doubling from the first to the last.
+RECONNECT_MIN_SECONDS = 0.5
+RECONNECT_MAX_SECONDS = 30
+
+
+def notify(event_type: str, **fields):
+    """pg_notify of an event on EVENTS_CHANNEL, as a column to select or
+    return from the write it is about. The event is then sent by the same
+    statement: once it commits, and not at all on rollback. fields are
+    column expressions; Postgres caps a payload at 8000 bytes, so events
+    carry ids and counts, not bodies.
+
+    A SELECT only calls it for the rows that are fetched, so fetch them
+    all; RETURNING calls it for every row written."""
+    payload = sqlalchemy.func.json_build_object(
+        sqlalchemy.cast("type", sqlalchemy.Text),
+        sqlalchemy.cast(event_type, sqlalchemy.Text),
+        *(
+            argument
+            for name, column in fields.items()
+            for argument in (sqlalchemy.cast(name, sqlalchemy.Text), column)
+        ),
+    )
+    return sqlalchemy.func.pg_notify(EVENTS_CHANNEL, sqlalchemy.cast(payload, sqlalchemy.Text)).label(
+        "notified"
+    )
+
+
+class EventBroker:
+    """Fans the events of EVENTS_CHANNEL out to the subscribers of this
+    worker. The worker holds a single LISTEN connection however many
+    clients are streaming; each subscriber gets its own bounded queue and
+    a subscriber that falls behind misses events rather than holding up
+    the others.
+
+    When the connection is lost, the open streams are ended, since they
+    would miss every event until it is back, and the broker listens again
+    with backoff. Clients reconnect and can catch up by polling."""
+
+    def __init__(self, queue_size: int) -> None:
+        self.queue_size = queue_size
+        self._subscribers: set[asyncio.Queue] = set()
+        self._connection: Optional[asyncpg.Connection] = None
+        self._dsn: Optional[str] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+
+    @property
+    def reconnecting(self) -> bool:
+        return self._reconnect_task is not None
+
+    async def start(self, dsn: str) -> None:
+        self._dsn = dsn
+        await self._listen()
+
+    async def _listen(self) -> None:
+        logger.debug("Listening for post events")
+
+        connection = await asyncpg.connect(self._dsn)
+        try:
+            connection.add_termination_listener(self._on_termination)
+            await connection.add_listener(EVENTS_CHANNEL, self._on_notification)
+        except BaseException:
+            connection.remove_termination_listener(self._on_termination)
+            await connection.close()
+            raise
+        self._connection = connection
+
+    async def stop(self) -> None:
+        if self._reconnect_task:
+            task, self._reconnect_task = self._reconnect_task, None
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+        if self._connection:
+            connection, self._connection = self._connection, None
+            connection.remove_termination_listener(self._on_termination)
+            await connection.close()
+
+        self._end_streams()
+
+    def _end_streams(self) -> None:
+        # Subscribers are dropped as well, so a stream gets a single end
+        # marker however many times this runs.
+        for queue in self._subscribers:
+            queue.put_nowait(None)
+        self._subscribers.clear()
+
+    def _on_termination(self, connection: asyncpg.Connection) -> None:
+        if connection is not self._connection:
+            return
+
+        logger.error("Lost the connection listening for post events, reconnecting")
+
+        self._connection = None
+        self._end_streams()
+        self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        delay = RECONNECT_MIN_SECONDS
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self._listen()
+            except Exception:
+                logger.warning("Failed to listen for post events again, retrying in %s s", delay, exc_info=True)
+                delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+                continue
+
+            logger.info("Listening for post events again")
+            self._reconnect_task = None
+            return
+
+    def _on_notification(self, connection: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+        self.dispatch(json.loads(payload))
+
+    def dispatch(self, event: dict) -> None:
+        for queue in self._subscribers:
+            if queue.qsize() >= self.queue_size:
+                logger.warning("Dropping %s event for a slow subscriber", event["type"])
+                continue
+            queue.put_nowait(event)
+
+    @contextmanager
+    def subscribe(self) -> Iterator[asyncio.Queue]:
+        # dispatch() stops at queue_size, which leaves room for the end of
+        # stream marker put by stop().
+        queue = asyncio.Queue(self.queue_size + 1)
+        self._subscribers.add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers.discard(queue)
+
+
+event_broker = EventBroker(config.EVENTS_QUEUE_SIZE)
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+
+import sqlalchemy
+from databases import Database
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .config import config
+from .database import post_table, like_table, post_version_seq
+from .events import notify
+from .ranking import most_liked_index
+
+
+logger = logging.getLogger(__name__)
+
+
+def insert_likes(data: list[dict]):
+    """INSERT ... ON CONFLICT DO NOTHING for the likes and, in the same
+    statement, add the new likes of every post to its like_count.
+    Returns the new likes only, with the new like count of their post,
+    and sends a post_liked event for each of them; likes that already
+    existed are skipped."""
+    inserted = (
+        pg_insert(like_table)
+        .values(data)
+        .on_conflict_do_nothing(index_elements=[like_table.c.post_id, like_table.c.user_id])
+        .returning(*like_table.c)
+        .cte("inserted_likes")
+    )
+    # One row per post: an UPDATE joined to several rows of the same post
+    # would apply only one of them.
+    new_likes = (
+        sqlalchemy.select(inserted.c.post_id, sqlalchemy.func.count().label("likes"))
+        .group_by(inserted.c.post_id)
+        .cte("new_likes")
+    )
+    updated_posts = (
+        post_table.update()
+        .where(post_table.c.id == new_likes.c.post_id)
+        .values(like_count=post_table.c.like_count + new_likes.c.likes, version=post_version_seq.next_value())
+        .returning(post_table.c.id, post_table.c.like_count)
+        .cte("updated_posts")
+    )
+
+    return sqlalchemy.select(
+        inserted.c.id,
+        inserted.c.post_id,
+        inserted.c.user_id,
+        updated_posts.c.like_count.label("likes"),
+        notify(
+            "post_liked",
+            post_id=inserted.c.post_id,
+            user_id=inserted.c.user_id,
+            likes=updated_posts.c.like_count,
+        ),
+    ).join_from(inserted, updated_posts, updated_posts.c.id == inserted.c.post_id)
+
+
+class LikeBuffer:
+    """Write-behind buffer for likes, opt-in with LIKE_BUFFER_ENABLED.
+
+    Likes are held in memory, deduplicated per (post id, user id), and
+    written with one multi-row insert every LIKE_BUFFER_FLUSH_SECONDS or as
+    soon as LIKE_BUFFER_MAX_SIZE of them are waiting, and once more when
+    the app shuts down. No more than LIKE_BUFFER_MAX_SIZE likes wait: once
+    full, callers write likes directly until a flush makes room (see
+    like_post).
+
+    A worker that dies without shutting down loses the likes it has not
+    written yet: the batch being flushed, if any, and up to
+    LIKE_BUFFER_MAX_SIZE likes waiting for the next one. Likes of posts
+    that do not exist are dropped at flush time, and so are likes that a
+    failed flush cannot put back (see flush)."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        # A dict keeps insertion order, so likes are written in the order
+        # they came in.
+        self._pending: dict[tuple[int, int], None] = {}
+        # One flush at a time; the flush on shutdown waits for one still
+        # running from the periodic task.
+        self._flush_lock = asyncio.Lock()
+
+    def add(self, post_id: int, user_id: int) -> bool:
+        """Buffer a like; False when the same like is already waiting."""
+        if (post_id, user_id) in self._pending:
+            return False
+
+        self._pending[(post_id, user_id)] = None
+        return True
+
+    def discard(self, post_id: int, user_id: int) -> bool:
+        """Drop a like that has not been written yet; False when there is none."""
+        if (post_id, user_id) not in self._pending:
+            return False
+
+        del self._pending[(post_id, user_id)]
+        return True
+
+    @property
+    def full(self) -> bool:
+        return len(self._pending) >= self.max_size
+
+    async def flush(self, database: Database) -> int:
+        """Write the buffered likes and return how many were new. A failed
+        write is logged and its likes are put back for the next flush as
+        far as there is room under max_size next to the likes that came in
+        meanwhile; the others are dropped."""
+        async with self._flush_lock:
+            return await self._flush(database)
+
+    async def _flush(self, database: Database) -> int:
+        # Likes coming in while this batch is written go to the next one.
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        logger.debug("Flushing %s buffered likes", len(pending))
+
+        try:
+            query = sqlalchemy.select(post_table.c.id).where(
+                post_table.c.id.in_({post_id for post_id, _ in pending})
+            )
+
+            logger.debug(query)
+
+            existing = {row.id for row in await database.fetch_all(query)}
+            data = [
+                {"post_id": post_id, "user_id": user_id}
+                for post_id, user_id in pending
+                if post_id in existing
+            ]
+            if not data:
+                return 0
+
+            query = insert_likes(data)
+
+            logger.debug(query)
+
+            created = await database.fetch_all(query)
+        except Exception:
+            # Keep the batch for the next flush, within the size bound.
+            room = max(self.max_size - len(self._pending), 0)
+            kept = dict.fromkeys(list(pending)[:room])
+            self._pending = {**kept, **self._pending}
+            logger.exception("Failed to flush likes, dropped %s", len(pending) - len(kept))
+            return 0
+
+        for like in created:
+            most_liked_index.increment(like.post_id)
+
+        return len(created)
+
+    async def flush_forever(self, database: Database, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            # Cancelling the task must not abandon a batch half written.
+            await asyncio.shield(self.flush(database))
+
+
+like_buffer = LikeBuffer(config.LIKE_BUFFER_MAX_SIZE)
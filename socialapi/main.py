@@ -1,12 +1,20 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.exception_handlers import http_exception_handler
 from . import post_router
 from . import user_router
 from . import upload_router
 from contextlib import asynccontextmanager
-from .database import database
+from .database import database, replica_databases, last_write_at, connection_string
+from .events import event_broker
+from .ranking import most_liked_index
+from .like_buffer import like_buffer
+from .security import log_auth_stats_forever, prune_refresh_tokens_forever
+from .config import config
 from .logging_conf import configure_logging
+import asyncio
 import logging
+import math
+import time
 from asgi_correlation_id import CorrelationIdMiddleware
 
 
@@ -16,7 +24,28 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     configure_logging()
     await database.connect()
+    for replica in replica_databases:
+        await replica.connect()
+    await most_liked_index.load(database)
+    await event_broker.start(connection_string)
+    reconcile_task = asyncio.create_task(
+        most_liked_index.reconcile_forever(database, config.MOST_LIKED_RECONCILE_SECONDS)
+    )
+    prune_task = asyncio.create_task(prune_refresh_tokens_forever(database, config.REFRESH_TOKEN_PRUNE_SECONDS))
+    stats_task = asyncio.create_task(log_auth_stats_forever(config.AUTH_STATS_LOG_SECONDS))
+    flush_task = None
+    if config.LIKE_BUFFER_ENABLED:
+        flush_task = asyncio.create_task(like_buffer.flush_forever(database, config.LIKE_BUFFER_FLUSH_SECONDS))
     yield
+    reconcile_task.cancel()
+    prune_task.cancel()
+    stats_task.cancel()
+    if flush_task:
+        flush_task.cancel()
+        await like_buffer.flush(database)
+    await event_broker.stop()
+    for replica in replica_databases:
+        await replica.disconnect()
     await database.disconnect()
 
 app = FastAPI(lifespan=lifespan)
@@ -31,6 +60,33 @@ app.include_router(user_router, prefix=prefix_users)
 prefix_files = "/files"
 app.include_router(upload_router, prefix=prefix_files)
 
+LAST_WRITE_COOKIE = "last_write_at"
+
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    """Remember in a cookie when the client last wrote so that its reads
+    stay on the primary until the replicas have caught up."""
+    if not replica_databases:
+        return await call_next(request)
+
+    try:
+        last_write_at.set(float(request.cookies[LAST_WRITE_COOKIE]))
+    except (KeyError, ValueError):
+        last_write_at.set(None)
+
+    response = await call_next(request)
+
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        response.set_cookie(
+            LAST_WRITE_COOKIE,
+            str(time.time()),
+            max_age=math.ceil(config.READ_YOUR_WRITES_SECONDS),
+            httponly=True
+        )
+
+    return response
+
 @app.get("/")
 async def root():
     return {"message": "Hello from FastAPI!"}
@@ -1,2 +1,2 @@
-from .post import UserPost, UserPostIn, CommentIn, Comment, UserPostWithComments, PostLike, PostLikeIn, UserPostWithLikes
-from .user import User, UserIn
\ No newline at end of file
+from .post import UserPost, UserPostIn, CommentIn, Comment, UserPostWithComments, UserPostBatch, PostLike, PostLikeIn, LikeAccepted, UserPostWithLikes
+from .user import User, UserIn, RefreshTokenIn
\ No newline at end of file
@@ -27,9 +27,16 @@ class UserPostWithComments(BaseModel):
     post: UserPostWithLikes
     comments: list[Comment]
 
+class UserPostBatch(BaseModel):
+    posts: list[UserPostWithComments]
+    missing: list[int]
+
 class PostLikeIn(BaseModel):
     post_id: int
 
 class PostLike(PostLikeIn):
     id: int
     user_id: int
+
+class LikeAccepted(BaseModel):
+    detail: str
@@ -9,3 +9,6 @@ class User(UserBase):
 
 class UserIn(UserBase):
     password: str
+
+class RefreshTokenIn(BaseModel):
+    refresh_token: str
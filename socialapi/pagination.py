@@ -0,0 +1,60 @@
+import base64
+import binascii
+import json
+import logging
+
+from fastapi import HTTPException, status
+
+
+logger = logging.getLogger(__name__)
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# Cursor for GET /posts/{post_id}/comments handed out by the post detail.
+NEXT_COMMENTS_CURSOR_HEADER = "X-Next-Comments-Cursor"
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Largest value of an integer column; a bigger parameter makes asyncpg fail.
+MAX_INTEGER = 2**31 - 1
+
+
+def encode_cursor(position: dict) -> str:
+    """Pack the sort key of the last row of a page into an opaque token."""
+    raw = json.dumps(position, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def valid_cursor_value(value, is_float: bool) -> bool:
+    if isinstance(value, bool):
+        return False
+    if is_float:
+        return isinstance(value, (int, float))
+    return isinstance(value, int) and -MAX_INTEGER - 1 <= value <= MAX_INTEGER
+
+
+def decode_cursor(cursor: str, expected_keys: set[str], float_keys: frozenset[str] = frozenset()) -> dict:
+    """Unpack a token produced by encode_cursor, rejecting anything that
+    does not carry exactly the keys of the current sort order. Values are
+    integers that fit an integer column, except those of float_keys."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (binascii.Error, UnicodeError, ValueError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from e
+
+    if not isinstance(position, dict) or set(position) != expected_keys:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    if not all(valid_cursor_value(value, key in float_keys) for key, value in position.items()):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    logger.debug("Decoded cursor %s", position)
+
+    return position
+
+
+def split_page(rows: list, limit: int) -> tuple[list, bool]:
+    """Queries fetch limit + 1 rows; the extra row only tells us whether
+    another page exists."""
+    return rows[:limit], len(rows) > limit
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+from typing import Optional
+
+import sqlalchemy
+from databases import Database
+from sortedcontainers import SortedList
+
+from .database import post_table
+
+
+logger = logging.getLogger(__name__)
+
+
+class MostLikedIndex:
+    """In-process ranking of post ids by (like count, id), highest first.
+
+    Every worker keeps its own copy: it is loaded once at startup, updated
+    by the likes that worker handles and periodically reconciled against
+    the database to pick up likes handled by other workers."""
+
+    def __init__(self) -> None:
+        self.loaded = False
+        self._likes: dict[int, int] = {}
+        # Keys are negated so that the natural ascending order of the
+        # sorted list is the "most liked first" order of the feed.
+        self._ranking = SortedList()
+
+    async def load(self, database: Database) -> None:
+        logger.debug("Loading most liked index from the database")
+
+        query = sqlalchemy.select(post_table.c.id, post_table.c.like_count)
+
+        logger.debug(query)
+
+        rows = await database.fetch_all(query)
+
+        self._likes = {row.id: row.like_count for row in rows}
+        self._ranking = SortedList((-likes, -post_id) for post_id, likes in self._likes.items())
+        self.loaded = True
+
+        logger.debug("Most liked index holds %s posts", len(self._likes))
+
+    async def reconcile_forever(self, database: Database, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.load(database)
+            except Exception:
+                logger.exception("Failed to reconcile most liked index")
+
+    def set(self, post_id: int, likes: int) -> None:
+        current = self._likes.get(post_id)
+        if current is not None:
+            self._ranking.remove((-current, -post_id))
+
+        self._likes[post_id] = likes
+        self._ranking.add((-likes, -post_id))
+
+    def add_post(self, post_id: int) -> None:
+        if self.loaded:
+            self.set(post_id, 0)
+
+    def increment(self, post_id: int, delta: int = 1) -> None:
+        # A post this worker has not seen yet was created elsewhere; the
+        # next reconciliation brings it in with its real count.
+        if self.loaded and post_id in self._likes:
+            self.set(post_id, self._likes[post_id] + delta)
+
+    def top(self, limit: int, after: Optional[tuple[int, int]] = None) -> list[tuple[int, int]]:
+        """Return up to limit (post id, likes) pairs, starting right after
+        the (likes, post id) position when one is given."""
+        start = 0
+        if after is not None:
+            likes, post_id = after
+            start = self._ranking.bisect_right((-likes, -post_id))
+
+        return [(-post_id, -likes) for likes, post_id in self._ranking.islice(start, start + limit)]
+
+    def __len__(self) -> int:
+        return len(self._likes)
+
+
+most_liked_index = MostLikedIndex()
@@ -0,0 +1,71 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+from fastapi import HTTPException, status
+
+from .config import config
+
+
+class TokenBucketLimiter:
+    """In-process token buckets, one per key. A bucket holds up to burst
+    tokens and regains per_minute of them every minute; each attempt takes
+    one. At most max_keys buckets are kept, the least recently used being
+    dropped first, which at worst hands a forgotten key a full bucket
+    again.
+
+    Every worker keeps its own buckets, so the limits hold per worker."""
+
+    def __init__(self, burst: int, per_minute: float, max_keys: int) -> None:
+        self.burst = burst
+        self.rate = per_minute / 60
+        self.max_keys = max_keys
+        # Least recently used first; values are (tokens, time of last refill).
+        self._buckets: OrderedDict[Hashable, tuple[float, float]] = OrderedDict()
+
+    def _refilled(self, key: Hashable, now: float) -> float:
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def retry_after(self, key: Hashable) -> float:
+        """Seconds until the key has a token, 0 when it has one now."""
+        tokens = self._refilled(key, time.monotonic())
+        return 0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def take(self, key: Hashable) -> None:
+        now = time.monotonic()
+        self._buckets[key] = (self._refilled(key, now) - 1, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+login_email_limiter = TokenBucketLimiter(
+    config.LOGIN_EMAIL_BURST, config.LOGIN_EMAIL_PER_MINUTE, config.RATE_LIMIT_MAX_KEYS
+)
+login_ip_limiter = TokenBucketLimiter(
+    config.LOGIN_IP_BURST, config.LOGIN_IP_PER_MINUTE, config.RATE_LIMIT_MAX_KEYS
+)
+
+
+def throttle_login(email: str, ip: str) -> None:
+    """Take a login attempt from the buckets of the account and of the
+    client address, or raise 429 when either is empty. Neither bucket is
+    charged for a refused attempt, which does no bcrypt work."""
+    retry_after = max(login_email_limiter.retry_after(email), login_ip_limiter.retry_after(ip))
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+    login_email_limiter.take(email)
+    login_ip_limiter.take(ip)
@@ -1,10 +1,35 @@
-from fastapi import APIRouter, HTTPException, status, Depends, BackgroundTasks, Request
-from .. import UserPost, UserPostIn, CommentIn, Comment, UserPostWithComments, User, PostLike, PostLikeIn, UserPostWithLikes
-from ..database import post_table, comments_table, like_table, database
+from fastapi import APIRouter, HTTPException, status, Depends, BackgroundTasks, Request, Response, Query, Body
+from fastapi.responses import StreamingResponse, JSONResponse
+from .. import UserPost, UserPostIn, CommentIn, Comment, UserPostWithComments, UserPostBatch, User, PostLike, PostLikeIn, LikeAccepted, UserPostWithLikes
+from ..database import (
+    post_table,
+    comments_table,
+    like_table,
+    users_table,
+    follows_table,
+    timelines_table,
+    post_version_seq,
+    database,
+    get_read_database,
+    SEARCH_CONFIG
+)
+from ..config import config
 from ..security import get_current_user
-from ..tasks import generate_and_add_to_post
-from typing import Annotated
+from ..tasks import generate_and_add_to_post, fan_out_posts
+from ..ranking import most_liked_index
+from ..like_buffer import like_buffer, insert_likes
+from ..events import event_broker, notify
+from ..serialization import json_response, rows_to_json, row_to_dict, model_fields, parse_fields
+from ..etag import make_etag, etag_matches, not_modified
+from ..pagination import NEXT_CURSOR_HEADER, NEXT_COMMENTS_CURSOR_HEADER, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, MAX_INTEGER, encode_cursor, decode_cursor, split_page
+from typing import Annotated, Optional
 from enum import Enum
+from asyncpg.exceptions import ForeignKeyViolationError
+from databases import Database
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by, websearch_to_tsquery
+import asyncio
+import json
+import orjson
 import sys
 import logging
 import sqlalchemy
@@ -12,22 +37,128 @@ import sqlalchemy
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+MAX_BATCH_SIZE = 100
+MAX_BATCH_IDS = 300
+EXPORT_CHUNK_SIZE = 500
+
 
-select_post_and_likes = (
-    sqlalchemy.select(post_table, sqlalchemy.func.count(like_table.c.id).label("likes"))
-    .select_from(post_table.outerjoin(like_table))
-    .group_by(post_table.c.id)
+select_post_and_likes = sqlalchemy.select(
+    post_table.c.id,
+    post_table.c.body,
+    post_table.c.user_id,
+    post_table.c.image_url,
+    post_table.c.like_count.label("likes")
 )
 
+POST_COLUMNS = {column.name: column for column in select_post_and_likes.selected_columns}
+
+FieldsQuery = Annotated[Optional[str], Query(description="Comma separated fields to return instead of all of them")]
+BodyLengthQuery = Annotated[Optional[int], Query(ge=1, description="Cut post bodies to this many characters")]
+
+
+def select_post_fields(fields: tuple[str, ...], body_length: Optional[int] = None):
+    """select_post_and_likes narrowed to the requested fields, with the
+    body cut to body_length characters by Postgres. The id is always
+    selected, pages are cut after it."""
+    columns = []
+    for name in dict.fromkeys(("id", *fields)):
+        if name == "body" and body_length:
+            columns.append(sqlalchemy.func.left(post_table.c.body, body_length).label("body"))
+        else:
+            columns.append(POST_COLUMNS[name])
+
+    return sqlalchemy.select(*columns)
+
+
+def select_comment_fields(fields: tuple[str, ...]) -> list:
+    """Columns of comments_table for the requested fields, id always
+    included as pages are cut after it."""
+    return [comments_table.c[name] for name in dict.fromkeys(("id", *fields))]
+
+
+def select_post_with_comments(
+    post_id: int,
+    comments_limit: int,
+    fields: tuple[str, ...] = model_fields(UserPostWithLikes),
+    comment_fields: tuple[str, ...] = model_fields(Comment)
+):
+    """Post, like count and its first comments in one row; the comments
+    come back as a JSON array built by Postgres so the page costs a single
+    round trip. One comment more than the limit is fetched to tell whether
+    there are more to page through."""
+    first_comments = (
+        sqlalchemy.select(
+            comments_table.c.id,
+            # Keys are bound parameters; json_build_object takes any type,
+            # so they need a cast for Postgres to know theirs.
+            sqlalchemy.func.json_build_object(
+                *[
+                    part
+                    for column in select_comment_fields(comment_fields)
+                    for part in (sqlalchemy.cast(column.name, sqlalchemy.Text), column)
+                ]
+            ).label("comment")
+        )
+        .where(comments_table.c.post_id == post_id)
+        .order_by(comments_table.c.id)
+        .limit(comments_limit + 1)
+        .subquery("first_comments")
+    )
+    comments = (
+        sqlalchemy.select(
+            sqlalchemy.func.coalesce(
+                sqlalchemy.func.json_agg(aggregate_order_by(first_comments.c.comment, first_comments.c.id)),
+                sqlalchemy.text("'[]'::json")
+            )
+        )
+        .scalar_subquery()
+    )
+
+    return (
+        select_post_fields(fields)
+        .add_columns(post_table.c.version, sqlalchemy.cast(comments, sqlalchemy.Text).label("comments"))
+        .where(post_table.c.id == post_id)
+    )
+
 
-async def find_post(post_id: int):
+def touch_posts(post_ids: set[int]):
+    """Move the posts to a new version so that their cached copies and the
+    cached feed pages go stale."""
+    return (
+        post_table.update()
+        .where(post_table.c.id.in_(post_ids))
+        .values(version=post_version_seq.next_value())
+        .returning(post_table.c.id)
+    )
+
+
+async def find_post(post_id: int, db: Database = database):
     logger.info("Finding post with id %s", post_id)
 
     query = post_table.select().where(post_table.c.id == post_id)
 
     logger.debug(query)
 
-    return await database.fetch_one(query)
+    return await db.fetch_one(query)
+
+
+def posts_not_found(post_ids: set[int]) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail=f"Posts not found: {', '.join(str(post_id) for post_id in sorted(post_ids))}"
+    )
+
+
+async def ensure_posts_exist(post_ids: set[int]):
+    logger.info("Checking that %s posts exist", len(post_ids))
+
+    query = sqlalchemy.select(post_table.c.id).where(post_table.c.id.in_(post_ids))
+
+    logger.debug(query)
+
+    missing = post_ids - {row.id for row in await database.fetch_all(query)}
+    if missing:
+        raise posts_not_found(missing)
 
 
 @router.post("/create_post", response_model=UserPost, status_code=status.HTTP_201_CREATED)
@@ -41,11 +172,16 @@ async def add_post(
     logger.info("Creating a post")
 
     data = {**user_post.model_dump(), "user_id": current_user.id}
-    query = post_table.insert().values(data)
+    query = post_table.insert().values(data).returning(
+        post_table.c.id, notify("post_created", post_id=post_table.c.id, user_id=post_table.c.user_id)
+    )
 
     logger.debug(query)
 
     last_record_id = await database.execute(query)
+    most_liked_index.add_post(last_record_id)
+
+    background_tasks.add_task(fan_out_posts, current_user.id, [last_record_id], database)
 
     if prompt:
         background_tasks.add_task(
@@ -60,94 +196,674 @@ async def add_post(
     return {**data, "id": last_record_id}
 
 
+@router.post("/create_posts", response_model=list[UserPost], status_code=status.HTTP_201_CREATED)
+async def add_posts(
+    user_posts: Annotated[list[UserPostIn], Body(min_length=1, max_length=MAX_BATCH_SIZE)],
+    current_user: Annotated[User, Depends(get_current_user)],
+    background_tasks: BackgroundTasks
+):
+    logger.info("Creating %s posts", len(user_posts))
+
+    data = [{**user_post.model_dump(), "user_id": current_user.id} for user_post in user_posts]
+    query = post_table.insert().values(data).returning(
+        post_table.c.id,
+        post_table.c.body,
+        post_table.c.user_id,
+        post_table.c.image_url,
+        notify("post_created", post_id=post_table.c.id, user_id=post_table.c.user_id),
+    )
+
+    logger.debug(query)
+
+    posts = sorted(await database.fetch_all(query), key=lambda post: post.id)
+
+    for post in posts:
+        most_liked_index.add_post(post.id)
+
+    background_tasks.add_task(fan_out_posts, current_user.id, [post.id for post in posts], database)
+
+    return posts
+
+
 class PostSorting(str, Enum):
     new = "new"
     old = "old"
     most_likes = "most_likes"
 
 
+def paginate_posts(query, sorting: PostSorting, cursor: Optional[str]):
+    """Apply the ordering of the requested sorting and, when a cursor is
+    given, start right after the row it points to."""
+    likes = post_table.c.like_count
+
+    if sorting == PostSorting.new:
+        if cursor:
+            position = decode_cursor(cursor, {"id"})
+            query = query.where(post_table.c.id < position["id"])
+        return query.order_by(post_table.c.id.desc())
+
+    if sorting == PostSorting.old:
+        if cursor:
+            position = decode_cursor(cursor, {"id"})
+            query = query.where(post_table.c.id > position["id"])
+        return query.order_by(post_table.c.id.asc())
+
+    if cursor:
+        position = decode_cursor(cursor, {"likes", "id"})
+        query = query.where(
+            sqlalchemy.tuple_(likes, post_table.c.id) < sqlalchemy.tuple_(position["likes"], position["id"])
+        )
+    return query.order_by(likes.desc(), post_table.c.id.desc())
+
+
+def post_cursor(post, sorting: PostSorting) -> str:
+    if sorting == PostSorting.most_likes:
+        return encode_cursor({"likes": post.likes, "id": post.id})
+    return encode_cursor({"id": post.id})
+
+
+async def get_most_liked_posts(db: Database, select_posts, limit: int, cursor: Optional[str]):
+    """Page through the in-memory ranking; the database is only asked for
+    the rows of the posts on the page, by primary key."""
+    after = None
+    if cursor:
+        position = decode_cursor(cursor, {"likes", "id"})
+        after = (position["likes"], position["id"])
+
+    ranked, has_more = split_page(most_liked_index.top(limit + 1, after), limit)
+    if not ranked:
+        return [], None
+
+    query = select_posts.where(post_table.c.id.in_([post_id for post_id, _ in ranked]))
+
+    logger.debug(query)
+
+    found = {post.id: post for post in await db.fetch_all(query)}
+    posts = [found[post_id] for post_id, _ in ranked if post_id in found]
+
+    next_cursor = None
+    if has_more:
+        last_id, last_likes = ranked[-1]
+        next_cursor = encode_cursor({"likes": last_likes, "id": last_id})
+
+    return posts, next_cursor
+
+
 @router.get("/", response_model=list[UserPostWithLikes])
-async def get_posts(sorting: PostSorting = PostSorting.new):
+async def get_posts(
+    request: Request,
+    response: Response,
+    sorting: PostSorting = PostSorting.new,
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    fields: FieldsQuery = None,
+    body_length: BodyLengthQuery = None
+):
     logger.info("Getting all posts with likes")
-    
-    if sorting == PostSorting.new:
-        query = select_post_and_likes.order_by(post_table.c.id.desc())
-    elif sorting == PostSorting.old:
-        query = select_post_and_likes.order_by(post_table.c.id.asc())
-    elif sorting == PostSorting.most_likes:
-        query = select_post_and_likes.order_by(sqlalchemy.desc("likes"))
+
+    fields = parse_fields(fields, UserPostWithLikes)
+
+    db = get_read_database()
+
+    # Versions are drawn from a sequence, in an order that is not the order
+    # of commits: a write still running may hold a version below the
+    # highest one visible, and committing it leaves the maximum as it was.
+    # Such a write is older than the commit that made that version visible,
+    # so it is listed as running in the snapshot; a list read while the
+    # snapshot lists any gets no ETag, so no client holds one that such a
+    # commit would leave unchanged.
+    writes_in_progress = sqlalchemy.select(
+        sqlalchemy.func.pg_snapshot_xip(sqlalchemy.func.pg_current_snapshot())
+    ).exists()
+    query = sqlalchemy.select(
+        sqlalchemy.func.max(post_table.c.version).label("version"),
+        writes_in_progress.label("writes_in_progress")
+    )
+
+    logger.debug(query)
+
+    latest = await db.fetch_one(query)
+
+    etag = make_etag("posts", latest.version or 0)
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return not_modified(etag)
+
+    if not latest.writes_in_progress:
+        response.headers["ETag"] = etag
+
+    if sorting == PostSorting.most_likes and most_liked_index.loaded:
+        posts, next_cursor = await get_most_liked_posts(db, select_post_fields(fields, body_length), limit, cursor)
+    else:
+        # Like counts are only read for the cursor when sorting by them.
+        cursor_fields = ("likes",) if sorting == PostSorting.most_likes else ()
+        query = paginate_posts(select_post_fields(fields + cursor_fields, body_length), sorting, cursor).limit(limit + 1)
+
+        logger.debug(query)
+
+        posts, has_more = split_page(await db.fetch_all(query), limit)
+        next_cursor = post_cursor(posts[-1], sorting) if has_more else None
+
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+    return json_response(rows_to_json(posts, fields), response)
+
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_posts():
+    logger.info("Exporting all posts with likes")
+
+    query = select_post_and_likes.order_by(post_table.c.id)
+
+    logger.debug(query)
+
+    async def generate_lines():
+        # Rows come from a server-side cursor and leave in chunks of
+        # newline-delimited JSON, so memory use does not grow with the table.
+        lines = []
+        async for post in get_read_database().iterate(query):
+            lines.append(orjson.dumps(row_to_dict(post, model_fields(UserPostWithLikes))))
+            if len(lines) == EXPORT_CHUNK_SIZE:
+                yield b"\n".join(lines) + b"\n"
+                lines = []
+
+        if lines:
+            yield b"\n".join(lines) + b"\n"
+
+    return StreamingResponse(generate_lines(), media_type="application/x-ndjson")
+
+
+@router.get("/search", response_model=list[UserPostWithLikes])
+async def search_posts(
+    response: Response,
+    q: Annotated[str, Query(min_length=1)],
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    fields: FieldsQuery = None,
+    body_length: BodyLengthQuery = None
+):
+    """Best matches first. The GIN index on search_vector finds the
+    matching posts; only those are ranked."""
+    logger.info("Searching posts")
+
+    fields = parse_fields(fields, UserPostWithLikes)
+
+    tsquery = websearch_to_tsquery(SEARCH_CONFIG, q)
+    rank = sqlalchemy.func.ts_rank(post_table.c.search_vector, tsquery, type_=sqlalchemy.Float)
+
+    query = (
+        select_post_fields(fields, body_length).add_columns(rank.label("rank"))
+        .where(post_table.c.search_vector.bool_op("@@")(tsquery))
+    )
+    if cursor:
+        position = decode_cursor(cursor, {"rank", "id"}, float_keys=frozenset({"rank"}))
+        query = query.where(
+            sqlalchemy.tuple_(rank, post_table.c.id)
+            < sqlalchemy.tuple_(sqlalchemy.literal(position["rank"], sqlalchemy.Float), position["id"])
+        )
+    query = query.order_by(rank.desc(), post_table.c.id.desc()).limit(limit + 1)
+
+    logger.debug(query)
+
+    posts, has_more = split_page(await get_read_database().fetch_all(query), limit)
+
+    if has_more:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor({"rank": posts[-1].rank, "id": posts[-1].id})
+
+    return json_response(rows_to_json(posts, fields), response)
+
+
+@router.get("/timeline", response_model=list[UserPostWithLikes])
+async def get_timeline(
+    current_user: Annotated[User, Depends(get_current_user)],
+    response: Response,
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    fields: FieldsQuery = None,
+    body_length: BodyLengthQuery = None
+):
+    """Newest posts of the accounts the user follows. Most come from the
+    precomputed timeline; posts of the user and of accounts too big to fan
+    out are merged in at read time."""
+    logger.info("Getting timeline of user %s", current_user.id)
+
+    fields = parse_fields(fields, UserPostWithLikes)
+
+    after = decode_cursor(cursor, {"id"})["id"] if cursor else None
+
+    fanned_out = (
+        sqlalchemy.select(timelines_table.c.post_id)
+        .where(timelines_table.c.user_id == current_user.id)
+        .order_by(timelines_table.c.post_id.desc())
+        .limit(limit + 1)
+    )
+    if after is not None:
+        fanned_out = fanned_out.where(timelines_table.c.post_id < after)
+
+    authors = sqlalchemy.union_all(
+        sqlalchemy.select(sqlalchemy.literal(current_user.id).label("id")),
+        sqlalchemy.select(follows_table.c.followee_id.label("id"))
+        .join(users_table, users_table.c.id == follows_table.c.followee_id)
+        .where(
+            follows_table.c.follower_id == current_user.id,
+            users_table.c.follower_count > config.TIMELINE_FANOUT_MAX_FOLLOWERS
+        )
+    ).subquery("authors")
+    # The newest posts of each author on their own, each a short backward
+    # range scan of the (user_id, id) index, rather than all their posts
+    # sorted together.
+    latest = (
+        sqlalchemy.select(post_table.c.id)
+        .where(post_table.c.user_id == authors.c.id)
+        .order_by(post_table.c.id.desc())
+        .limit(limit + 1)
+    )
+    if after is not None:
+        latest = latest.where(post_table.c.id < after)
+    latest = latest.lateral("latest_posts")
+    pulled = sqlalchemy.select(latest.c.id).select_from(authors).join(latest, sqlalchemy.true())
+
+    query = (
+        select_post_fields(fields, body_length)
+        .where(post_table.c.id.in_(sqlalchemy.union(fanned_out, pulled)))
+        .order_by(post_table.c.id.desc())
+        .limit(limit + 1)
+    )
 
     logger.debug(query)
 
-    return await database.fetch_all(query)
+    posts, has_more = split_page(await get_read_database().fetch_all(query), limit)
+
+    if has_more:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor({"id": posts[-1].id})
+
+    return json_response(rows_to_json(posts, fields), response)
+
+
+@router.get("/events", response_class=StreamingResponse)
+async def stream_events(post_id: Optional[int] = None):
+    """Server-Sent Events for new posts, comments, likes and images, of
+    every post or only of post_id. A comment line is sent when nothing
+    happened for EVENTS_KEEPALIVE_SECONDS so that proxies keep the
+    connection open."""
+    logger.info("Streaming post events")
+
+    if event_broker.reconnecting:
+        # Streams opened now would see no events until the broker listens
+        # again; clients poll meanwhile.
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Events are unavailable, try again later",
+            headers={"Retry-After": "1"},
+        )
+
+    async def generate_events():
+        with event_broker.subscribe() as queue:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), config.EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+
+                if event is None:
+                    return
+                if post_id is None or event["post_id"] == post_id:
+                    yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(generate_events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+def parse_ids(ids: str) -> list[int]:
+    """Ids of a comma separated ids= parameter, without duplicates and in
+    the order given."""
+    try:
+        parsed = list(dict.fromkeys(int(post_id) for post_id in ids.split(",") if post_id.strip()))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid ids") from e
+
+    if not parsed or not all(1 <= post_id <= MAX_INTEGER for post_id in parsed):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid ids")
+
+    if len(parsed) > MAX_BATCH_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {MAX_BATCH_IDS} ids can be fetched at once"
+        )
+
+    return parsed
+
+
+def id_array(ids: list[int]):
+    # A single array parameter keeps the statement text the same whatever
+    # the number of ids.
+    return sqlalchemy.cast(ids, ARRAY(sqlalchemy.Integer))
+
+
+@router.get("/batch", response_model=UserPostBatch)
+async def get_posts_batch(
+    ids: str,
+    comments_limit: Annotated[int, Query(ge=0, le=MAX_PAGE_SIZE)] = 0,
+    fields: FieldsQuery = None,
+    comment_fields: FieldsQuery = None
+):
+    """Posts of a comma separated list of ids, in that order, each with its
+    first comments_limit comments, in two queries whatever the number of
+    ids. Ids without a post are listed in missing."""
+    logger.info("Getting a batch of posts")
+
+    post_ids = parse_ids(ids)
+    fields = parse_fields(fields, UserPostWithLikes)
+    comment_fields = parse_fields(comment_fields, Comment)
+
+    db = get_read_database()
+
+    query = select_post_fields(fields).where(post_table.c.id == sqlalchemy.any_(id_array(post_ids)))
+
+    logger.debug(query)
+
+    found = {post.id: post for post in await db.fetch_all(query)}
+
+    comments = {post_id: [] for post_id in found}
+    if comments_limit and found:
+        # A lateral join reads at most comments_limit comments per post off
+        # the (post_id, id) index, however many comments a post has.
+        requested = sqlalchemy.func.unnest(id_array(list(found))).table_valued("id").render_derived(name="requested")
+        first_comments = (
+            sqlalchemy.select(*select_comment_fields(comment_fields))
+            .where(comments_table.c.post_id == requested.c.id)
+            .order_by(comments_table.c.id)
+            .limit(comments_limit)
+            .lateral("first_comments")
+        )
+        query = (
+            sqlalchemy.select(first_comments, requested.c.id.label("requested_id"))
+            .select_from(requested)
+            .join(first_comments, sqlalchemy.true())
+        )
+
+        logger.debug(query)
+
+        for comment in await db.fetch_all(query):
+            comments[comment.requested_id].append(row_to_dict(comment, comment_fields))
+
+    return json_response(orjson.dumps({
+        "posts": [
+            {"post": row_to_dict(found[post_id], fields), "comments": comments[post_id]}
+            for post_id in post_ids
+            if post_id in found
+        ],
+        "missing": [post_id for post_id in post_ids if post_id not in found]
+    }))
+
+
+def notify_comment_created():
+    return notify(
+        "comment_created",
+        post_id=comments_table.c.post_id,
+        comment_id=comments_table.c.id,
+        user_id=comments_table.c.user_id,
+    )
 
 
 @router.post("/create_comment", response_model=Comment, status_code=status.HTTP_201_CREATED)
 async def add_comment(comment: CommentIn, current_user: Annotated[User, Depends(get_current_user)]):
     logger.info("Creating a comment")
 
-    post = await find_post(comment.post_id)
-    if not post:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+    query = touch_posts({comment.post_id})
+
+    logger.debug(query)
 
     data = {**comment.model_dump(), "user_id": current_user.id}
-    query = comments_table.insert().values(data)
+    insert_query = comments_table.insert().values(data).returning(
+        comments_table.c.id, notify_comment_created()
+    )
 
-    logger.debug(query)
+    logger.debug(insert_query)
+
+    async with database.transaction():
+        if not await database.fetch_one(query):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+
+        last_record_id = await database.execute(insert_query)
 
-    last_record_id = await database.execute(query)
     return {**data, "id": last_record_id}
 
 
+@router.post("/create_comments", response_model=list[Comment], status_code=status.HTTP_201_CREATED)
+async def add_comments(
+    comments: Annotated[list[CommentIn], Body(min_length=1, max_length=MAX_BATCH_SIZE)],
+    current_user: Annotated[User, Depends(get_current_user)]
+):
+    logger.info("Creating %s comments", len(comments))
+
+    post_ids = {comment.post_id for comment in comments}
+    query = touch_posts(post_ids)
+
+    logger.debug(query)
+
+    data = [{**comment.model_dump(), "user_id": current_user.id} for comment in comments]
+    insert_query = comments_table.insert().values(data).returning(*comments_table.c, notify_comment_created())
+
+    logger.debug(insert_query)
+
+    async with database.transaction():
+        missing = post_ids - {post.id for post in await database.fetch_all(query)}
+        if missing:
+            raise posts_not_found(missing)
+
+        created = sorted(await database.fetch_all(insert_query), key=lambda comment: comment.id)
+
+    return created
+
+
 @router.get("/{post_id}/comments", response_model=list[Comment])
-async def get_comments(post_id: int, error_if_no_comments=True):
+async def get_comments(
+    post_id: int,
+    response: Response,
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    fields: FieldsQuery = None,
+    error_if_no_comments=True
+):
     logger.info("Getting comments for a post with id %s", post_id)
 
-    post = await find_post(post_id)
-    if not post:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
-    
-    query = comments_table.select().where(comments_table.c.post_id == post_id)
+    fields = parse_fields(fields, Comment)
+
+    db = get_read_database()
+
+    query = sqlalchemy.select(*select_comment_fields(fields)).where(comments_table.c.post_id == post_id)
+    if cursor:
+        position = decode_cursor(cursor, {"id"})
+        query = query.where(comments_table.c.id > position["id"])
+    query = query.order_by(comments_table.c.id).limit(limit + 1)
 
     logger.debug(query)
 
-    found_comments = await database.fetch_all(query)
+    found_comments, has_more = split_page(await db.fetch_all(query), limit)
+
+    if has_more:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor({"id": found_comments[-1].id})
 
-    if error_if_no_comments and not found_comments:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comments not found")
-    
-    return found_comments
+    if not found_comments and not cursor:
+        # Only an empty first page needs to know whether the post exists.
+        post = await find_post(post_id, db)
+        if not post:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+
+        if error_if_no_comments:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comments not found")
+
+    return json_response(rows_to_json(found_comments, fields), response)
 
 @router.get("/{post_id}", response_model=UserPostWithComments)
-async def get_post_with_comments(post_id: int):
+async def get_post_with_comments(
+    post_id: int,
+    request: Request,
+    response: Response,
+    comments_limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+    fields: FieldsQuery = None,
+    comment_fields: FieldsQuery = None
+):
     logger.info("Getting post with comments and likes; post id %s", post_id)
 
-    query = select_post_and_likes.where(post_table.c.id == post_id)
+    fields = parse_fields(fields, UserPostWithLikes)
+    comment_fields = parse_fields(comment_fields, Comment)
+
+    db = get_read_database()
+
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        # Only clients holding a cached copy pay for this lookup; it is a
+        # primary key read and spares the comments when nothing changed.
+        query = sqlalchemy.select(post_table.c.version).where(post_table.c.id == post_id)
+
+        logger.debug(query)
+
+        version = await db.fetch_val(query)
+        etag = make_etag("post", post_id, version) if version is not None else None
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
+    query = select_post_with_comments(post_id, comments_limit, fields, comment_fields)
 
     logger.debug(query)
 
-    post = await database.fetch_one(query)
+    post = await db.fetch_one(query)
     if not post:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
-    
-    return {
-        "post": post,
-        "comments": await get_comments(post_id, error_if_no_comments=False)
-    }
 
+    response.headers["ETag"] = make_etag("post", post_id, post.version)
+
+    # The comments were built as JSON by Postgres with the fields of
+    # Comment, so they go back out without passing through models.
+    comments, has_more = split_page(orjson.loads(post.comments), comments_limit)
+    if has_more:
+        response.headers[NEXT_COMMENTS_CURSOR_HEADER] = encode_cursor({"id": comments[-1]["id"]})
+
+    if "id" not in comment_fields:
+        comments = [{field: comment[field] for field in comment_fields} for comment in comments]
 
-@router.post("/like", response_model=PostLike, status_code=status.HTTP_201_CREATED)
-async def like_post(like: PostLikeIn, current_user: Annotated[User, Depends(get_current_user)]):
+    return json_response(
+        orjson.dumps({"post": row_to_dict(post, fields), "comments": comments}), response
+    )
+
+
+def select_likes(post_ids: list[int], user_id: int):
+    return like_table.select().where(like_table.c.post_id.in_(post_ids), like_table.c.user_id == user_id)
+
+
+@router.post(
+    "/like",
+    response_model=PostLike,
+    status_code=status.HTTP_201_CREATED,
+    responses={
+        status.HTTP_200_OK: {"model": PostLike, "description": "The post was liked already"},
+        status.HTTP_202_ACCEPTED: {"model": LikeAccepted, "description": "The like is buffered and written later"},
+    },
+)
+async def like_post(like: PostLikeIn, current_user: Annotated[User, Depends(get_current_user)], response: Response):
     logger.info("Creating a like")
 
-    post = await find_post(like.post_id)
-    if not post:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+    if config.LIKE_BUFFER_ENABLED and not like_buffer.full:
+        like_buffer.add(like.post_id, current_user.id)
+        if like_buffer.full:
+            await like_buffer.flush(database)
+        # The like is written later, so there is no row to return yet.
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED, content=LikeAccepted(detail="Like is accepted").model_dump()
+        )
+
+    if config.LIKE_BUFFER_ENABLED:
+        # Full again while a flush writes the previous batch: this like is
+        # written now, which slows its caller down instead of letting the
+        # buffer grow past its bound.
+        logger.debug("Like buffer is full, writing the like directly")
 
     data = {**like.model_dump(), "user_id": current_user.id}
-    query = like_table.insert().values(data)
+    query = insert_likes([data])
 
     logger.debug(query)
 
-    last_record_id = await database.execute(query)
-    return {**data, "id": last_record_id}
+    try:
+        created = await database.fetch_one(query)
+    except ForeignKeyViolationError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found") from e
+
+    if created:
+        most_liked_index.increment(like.post_id)
+        return created
+
+    logger.debug("Post %s is already liked by user %s", like.post_id, current_user.id)
+
+    query = select_likes([like.post_id], current_user.id)
+
+    logger.debug(query)
+
+    response.status_code = status.HTTP_200_OK
+    return await database.fetch_one(query)
+
+
+@router.delete("/like/{post_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def unlike_post(post_id: int, current_user: Annotated[User, Depends(get_current_user)]):
+    logger.info("Removing a like from post with id %s", post_id)
+
+    # The like may be waiting in the buffer, written already, or both when
+    # it was liked again before the flush.
+    discarded = like_buffer.discard(post_id, current_user.id)
+
+    deleted = (
+        like_table.delete()
+        .where(like_table.c.post_id == post_id, like_table.c.user_id == current_user.id)
+        .returning(like_table.c.post_id, like_table.c.user_id)
+        .cte("deleted_like")
+    )
+    query = (
+        post_table.update()
+        .where(post_table.c.id == deleted.c.post_id)
+        .values(like_count=post_table.c.like_count - 1, version=post_version_seq.next_value())
+        .returning(
+            post_table.c.id,
+            post_table.c.like_count,
+            notify("post_unliked", post_id=post_table.c.id, user_id=deleted.c.user_id, likes=post_table.c.like_count),
+        )
+    )
+
+    logger.debug(query)
+
+    post = await database.fetch_one(query)
+    if not post:
+        if discarded:
+            return
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Like not found")
+
+    most_liked_index.increment(post_id, -1)
+
+
+@router.post("/likes", response_model=list[PostLike], status_code=status.HTTP_201_CREATED)
+async def like_posts(
+    likes: Annotated[list[PostLikeIn], Body(min_length=1, max_length=MAX_BATCH_SIZE)],
+    current_user: Annotated[User, Depends(get_current_user)]
+):
+    logger.info("Creating %s likes", len(likes))
+
+    post_ids = list(dict.fromkeys(like.post_id for like in likes))
+
+    await ensure_posts_exist(set(post_ids))
+
+    query = insert_likes([{"post_id": post_id, "user_id": current_user.id} for post_id in post_ids])
+
+    logger.debug(query)
+
+    found = {like.post_id: like for like in await database.fetch_all(query)}
+
+    for post_id in found:
+        most_liked_index.increment(post_id)
+
+    if len(found) < len(post_ids):
+        query = select_likes([post_id for post_id in post_ids if post_id not in found], current_user.id)
+
+        logger.debug(query)
+
+        found.update({like.post_id: like for like in await database.fetch_all(query)})
+
+    return [found[post_id] for post_id in post_ids if post_id in found]
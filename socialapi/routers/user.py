@@ -1,18 +1,29 @@
-from fastapi import APIRouter, HTTPException, status, Request, BackgroundTasks
+from fastapi import APIRouter, HTTPException, status, Request, Response, BackgroundTasks, Depends
+from typing import Annotated
+from asyncpg.exceptions import ForeignKeyViolationError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import logging
-from .. import User, UserIn
+import sqlalchemy
+from .. import User, UserIn, RefreshTokenIn
+from ..config import config
 from ..security import (
+    get_current_user,
     get_user,
     get_password_hash,
     authenticate_user,
     create_access_token,
     create_credentials_exception,
     get_subject_for_token_type,
-    create_confirmation_token
+    create_confirmation_token,
+    create_refresh_token,
+    rotate_refresh_token,
+    revoke_refresh_token,
+    user_cache
 )
 from .. import tasks
+from ..rate_limit import throttle_login
 
-from ..database import users_table, database
+from ..database import users_table, follows_table, timelines_table, post_table, database
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -21,14 +32,14 @@ logger = logging.getLogger(__name__)
 @router.post("/register", status_code=status.HTTP_201_CREATED)
 async def register(user: UserIn, background_tasks: BackgroundTasks, request: Request):
 
-    if await get_user(user.email):
+    if await get_user(user.email, database):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User already exists")
 
     logger.info("Creating a user")
 
     data = user.model_dump()
 
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     data["password"] = hashed_password
 
     query = users_table.insert().values(data)
@@ -37,6 +48,8 @@ async def register(user: UserIn, background_tasks: BackgroundTasks, request: Req
 
     last_record_id = await database.execute(query)
 
+    user_cache.invalidate(user.email)
+
     logger.debug("Submitting background task to send email")
 
     background_tasks.add_task(
@@ -49,24 +62,63 @@ async def register(user: UserIn, background_tasks: BackgroundTasks, request: Req
 
 
 @router.post("/login")
-async def login(user: UserIn):
+async def login(user: UserIn, request: Request):
+    # Before any bcrypt work, so a flood of attempts cannot tie up the
+    # hashing workers.
+    throttle_login(user.email, request.client.host if request.client else "")
+
     user = await authenticate_user(user.email, user.password)
 
     if not user:
         raise create_credentials_exception("User with this token not found")
     
-    access_token = create_access_token(user.email)
+    access_token = create_access_token(user.email, user.id, user.confirmed)
+    refresh_token = await create_refresh_token(user.id)
+
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+
+@router.post("/refresh")
+async def refresh(token: RefreshTokenIn):
+    """A new access token for a refresh token, without the bcrypt check of
+    a login. The refresh token is replaced by the one returned."""
+    logger.info("Refreshing an access token")
+
+    user, refresh_token = await rotate_refresh_token(token.refresh_token)
+
+    access_token = create_access_token(user.email, user.id, user.confirmed)
+
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
-    return {"access_token": access_token, "token_type": "bearer"}
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(token: RefreshTokenIn):
+    logger.info("Logging out")
+
+    await revoke_refresh_token(token.refresh_token)
 
 
 @router.get("/confirm/{token}")
 async def confirm_email(token: str):
     email = get_subject_for_token_type(token, "confirmation")
 
-    logger.debug("Fetching user from the database", extra={"email": email})
-
-    query = users_table.select().where(users_table.c.email == email)
+    logger.debug("Confirming user", extra={"email": email})
+
+    # The outer select reads users as they were before the update, and
+    # confirmed_now tells whether this request flipped the flag: of two
+    # requests racing on the same link, only one does.
+    confirmed = (
+        users_table.update()
+        .where(users_table.c.email == email, users_table.c.confirmed == False)
+        .values(confirmed=True)
+        .returning(users_table.c.id)
+        .cte("confirmed_user")
+    )
+    query = (
+        sqlalchemy.select(confirmed.c.id.is_not(None).label("confirmed_now"))
+        .select_from(users_table.outerjoin(confirmed, confirmed.c.id == users_table.c.id))
+        .where(users_table.c.email == email)
+    )
 
     logger.debug(query)
 
@@ -75,21 +127,108 @@ async def confirm_email(token: str):
     if not result:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User doesn't exist")
 
-    logger.debug("Fetching user from the database", extra={"email": email})
+    if not result.confirmed_now:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User already confirmed")
 
-    query = users_table.select().where(users_table.c.email == email, users_table.c.confirmed == False)
+    user_cache.invalidate(email)
 
-    logger.debug(query)
+    return {"detail": "User is confirmed"}
 
-    result = await database.fetch_one(query)
 
-    if not result:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User already confirmed")
+@router.post("/{user_id}/follow", status_code=status.HTTP_201_CREATED)
+async def follow_user(user_id: int, current_user: Annotated[User, Depends(get_current_user)], response: Response):
+    logger.info("User %s follows user %s", current_user.id, user_id)
+
+    if user_id == current_user.id:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Users cannot follow themselves")
 
-    query = users_table.update().where(users_table.c.email == email).values(confirmed=True)
+    inserted = (
+        pg_insert(follows_table)
+        .values(follower_id=current_user.id, followee_id=user_id)
+        .on_conflict_do_nothing()
+        .returning(follows_table.c.followee_id)
+        .cte("inserted_follow")
+    )
+    query = (
+        users_table.update()
+        .where(users_table.c.id == inserted.c.followee_id)
+        .values(follower_count=users_table.c.follower_count + 1)
+        .returning(users_table.c.follower_count)
+    )
 
     logger.debug(query)
 
-    await database.execute(query)
+    async with database.transaction():
+        try:
+            followee = await database.fetch_one(query)
+        except ForeignKeyViolationError as e:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found") from e
+
+        if not followee:
+            response.status_code = status.HTTP_200_OK
+            return {"detail": "User is already followed"}
+
+        if followee.follower_count <= config.TIMELINE_FANOUT_MAX_FOLLOWERS:
+            # Posts written before the follow never went through fan-out.
+            recent_posts = (
+                sqlalchemy.select(sqlalchemy.literal(current_user.id), post_table.c.id)
+                .where(post_table.c.user_id == user_id)
+                .order_by(post_table.c.id.desc())
+                .limit(config.TIMELINE_BACKFILL_POSTS)
+            )
+            query = (
+                pg_insert(timelines_table)
+                .from_select(["user_id", "post_id"], recent_posts)
+                .on_conflict_do_nothing()
+            )
+
+            logger.debug(query)
+
+            await database.execute(query)
+
+    return {"detail": "User is followed"}
+
+
+@router.delete("/{user_id}/follow", status_code=status.HTTP_204_NO_CONTENT)
+async def unfollow_user(
+    user_id: int, current_user: Annotated[User, Depends(get_current_user)], background_tasks: BackgroundTasks
+):
+    logger.info("User %s unfollows user %s", current_user.id, user_id)
+
+    deleted = (
+        follows_table.delete()
+        .where(follows_table.c.follower_id == current_user.id, follows_table.c.followee_id == user_id)
+        .returning(follows_table.c.followee_id)
+        .cte("deleted_follow")
+    )
+    query = (
+        users_table.update()
+        .where(users_table.c.id == deleted.c.followee_id)
+        .values(follower_count=users_table.c.follower_count - 1)
+        .returning(users_table.c.follower_count)
+    )
 
-    return {"detail": "User is confirmed"}
+    logger.debug(query)
+
+    async with database.transaction():
+        followee = await database.fetch_one(query)
+        if not followee:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User is not followed")
+
+        if followee.follower_count == config.TIMELINE_FANOUT_MAX_FOLLOWERS:
+            # Back under the threshold: the followee's posts are no longer
+            # pulled in at read time, so they go into timelines instead.
+            background_tasks.add_task(tasks.backfill_timelines, user_id, database)
+
+        query = (
+            timelines_table.delete()
+            .where(
+                timelines_table.c.user_id == current_user.id,
+                timelines_table.c.post_id == post_table.c.id,
+                post_table.c.user_id == user_id
+            )
+        )
+
+        logger.debug(query)
+
+        await database.execute(query)
@@ -1,18 +1,38 @@
-from .database import database, users_table
+from .cache import TTLCache
+from .database import database, users_table, refresh_tokens_table, get_read_database
+from databases import Database
+import asyncio
+import hashlib
 import logging
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
 from jose import ExpiredSignatureError, JWTError, jwt
 import bcrypt
 import datetime
+import sqlalchemy
 from .config import config
+from .models.user import User
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
-from typing import Annotated, Literal
+from typing import Annotated, Any, Callable, Literal, Optional
 
 
 logger = logging.getLogger(__name__)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+# Confirmed users by email. Only confirmed users are cached: a user never
+# goes back to unconfirmed, so a worker that missed an invalidation still
+# answers correctly, and registering or confirming invalidates the entry
+# anyway.
+user_cache = TTLCache(config.USER_CACHE_SIZE, config.USER_CACHE_TTL_SECONDS)
+
+# (subject, type) of tokens already decoded, by the digest of the token,
+# each kept until the token expires. A token is signed and so cannot be
+# altered without changing its digest.
+token_cache = TTLCache(config.TOKEN_CACHE_SIZE, ttl=0)
+
 def create_credentials_exception(detail: str) -> HTTPException:
     return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -22,20 +42,28 @@ def create_credentials_exception(detail: str) -> HTTPException:
 
 
 def access_token_expire_minutes() -> int:
-    return 5
+    return config.ACCESS_TOKEN_EXPIRE_MINUTES
 
 
 def confirm_token_expire_minutes() -> int:
-    return 5
+    return config.CONFIRM_TOKEN_EXPIRE_MINUTES
+
+
+def refresh_token_expire_minutes() -> int:
+    return config.REFRESH_TOKEN_EXPIRE_MINUTES
 
 
-def create_access_token(email: str):
+def create_access_token(email: str, user_id: Optional[int] = None, confirmed: bool = False):
+    """With a user id, the token also carries the id and confirmation state
+    of the user, which get_current_user trusts when AUTH_CLAIMS_ONLY is on."""
     logger.debug("Creating access token", extra={"email": email})
 
     expire = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
         minutes=access_token_expire_minutes()
     )
     jwt_data = {"sub": email, "exp": expire, "type": "access"}
+    if user_id is not None:
+        jwt_data.update(uid=user_id, confirmed=confirmed)
     encoded_jwt = jwt.encode(jwt_data, key=config.JWT_SECRET_KEY, algorithm=config.JWT_ALGORITHM)
 
     return encoded_jwt
@@ -53,7 +81,16 @@ def create_confirmation_token(email: str):
     return encoded_jwt
 
 
-def get_subject_for_token_type(token: str, type: Literal["access", "confirmation"]) -> str:
+def decode_token(token: str) -> dict:
+    """Claims of a token, checking its signature and expiry only the first
+    time it is seen. The claims are shared with later calls, so callers
+    must not change them."""
+    digest = hashlib.sha256(token.encode("utf-8")).digest()
+
+    cached = token_cache.get(digest)
+    if cached:
+        return cached
+
     try:
         payload = jwt.decode(token, key=config.JWT_SECRET_KEY, algorithms=[config.JWT_ALGORITHM])
     except ExpiredSignatureError as e:
@@ -65,30 +102,298 @@ def get_subject_for_token_type(token: str, type: Literal["access", "confirmation
 
     if not email:
         raise create_credentials_exception("Token is missing 'sub' field")
-    
+
+    # jwt.decode checked that exp is a number when there is one; tokens
+    # without it are not cached as nothing would expire them.
+    expires_in = payload["exp"] - time.time() if "exp" in payload else 0
+    if expires_in > 0:
+        token_cache.set(digest, payload, ttl=expires_in)
+
+    return payload
+
+
+def get_claims_for_token_type(token: str, type: Literal["access", "confirmation"]) -> dict:
+    payload = decode_token(token)
+
     token_type = payload.get("type")
 
     if not token_type or token_type != type:
         raise create_credentials_exception("Incorrect type, expected %s" % (type))
 
-    return email
+    return payload
+
+
+def get_subject_for_token_type(token: str, type: Literal["access", "confirmation"]) -> str:
+    return get_claims_for_token_type(token, type)["sub"]
+
+def hash_refresh_token(token: str) -> str:
+    # Refresh tokens are random, so a plain digest is enough to keep a
+    # leaked table from handing them out; no salt or bcrypt needed.
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+async def create_refresh_token(user_id: int, family_id: Optional[str] = None) -> str:
+    """Issue a refresh token, starting a new family unless one is given."""
+    logger.debug("Creating refresh token", extra={"user_id": user_id})
+
+    token = secrets.token_urlsafe(32)
+    expire = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+        minutes=refresh_token_expire_minutes()
+    )
+    query = refresh_tokens_table.insert().values(
+        token_hash=hash_refresh_token(token),
+        family_id=family_id or secrets.token_hex(16),
+        user_id=user_id,
+        expires_at=expire
+    )
+
+    logger.debug(query)
+
+    await database.execute(query)
 
-def get_password_hash(password: str) -> str:
-    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode()
+    return token
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+async def revoke_refresh_token_family(family_id: str) -> None:
+    logger.debug("Revoking refresh token family %s", family_id)
+
+    query = refresh_tokens_table.update().where(refresh_tokens_table.c.family_id == family_id).values(revoked=True)
+
+    logger.debug(query)
+
+    await database.execute(query)
+
+
+async def rotate_refresh_token(token: str) -> tuple:
+    """Use up a refresh token and return its user with the refresh token
+    that replaces it.
+
+    A token is good for one use. Presenting one that was already used
+    means two parties hold it, so the whole family is revoked and the
+    legitimate client has to log in again too."""
+    token_hash = hash_refresh_token(token)
+    now = sqlalchemy.func.now()
+
+    used = (
+        refresh_tokens_table.update()
+        .where(
+            refresh_tokens_table.c.token_hash == token_hash,
+            refresh_tokens_table.c.used_at.is_(None),
+            refresh_tokens_table.c.revoked == False,
+            refresh_tokens_table.c.expires_at > now
+        )
+        .values(used_at=now)
+        .returning(refresh_tokens_table.c.user_id, refresh_tokens_table.c.family_id)
+        .cte("used_token")
+    )
+    query = sqlalchemy.select(used.c.family_id, users_table.c.id, users_table.c.email, users_table.c.confirmed).join_from(
+        used, users_table, users_table.c.id == used.c.user_id
+    )
+
+    logger.debug(query)
+
+    async with database.transaction():
+        used_token = await database.fetch_one(query)
+        if used_token:
+            new_token = await create_refresh_token(used_token.id, used_token.family_id)
+
+            # Keep only the token just used next to its replacement, so the
+            # family does not grow with every refresh. Replaying that token,
+            # the one a thief racing the client would hold, still revokes
+            # the family; older tokens are simply unknown from now on.
+            query = refresh_tokens_table.delete().where(
+                refresh_tokens_table.c.family_id == used_token.family_id,
+                refresh_tokens_table.c.used_at.is_not(None),
+                refresh_tokens_table.c.token_hash != token_hash
+            )
+
+            logger.debug(query)
+
+            await database.execute(query)
+
+            return used_token, new_token
+
+    query = refresh_tokens_table.select().where(refresh_tokens_table.c.token_hash == token_hash)
+
+    logger.debug(query)
+
+    stored = await database.fetch_one(query)
+
+    if not stored:
+        raise create_credentials_exception("Invalid refresh token")
+
+    if stored.revoked:
+        raise create_credentials_exception("Refresh token has been revoked")
+
+    if stored.used_at is not None:
+        logger.warning("Refresh token reused, revoking its family", extra={"user_id": stored.user_id})
+        await revoke_refresh_token_family(stored.family_id)
+        raise create_credentials_exception("Refresh token has already been used")
+
+    raise create_credentials_exception("Refresh token has expired")
+
+
+async def prune_refresh_tokens(db: Database) -> int:
+    """Delete expired refresh tokens, which can no longer be used however
+    they are presented."""
+    query = refresh_tokens_table.delete().where(refresh_tokens_table.c.expires_at < sqlalchemy.func.now())
+
+    logger.debug(query)
+
+    # execute() would only report the first row, so count what RETURNING
+    # gives back instead.
+    pruned = await db.fetch_all(query.returning(refresh_tokens_table.c.id))
+
+    logger.debug("Pruned %s expired refresh tokens", len(pruned))
+
+    return len(pruned)
+
+
+async def prune_refresh_tokens_forever(db: Database, interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await prune_refresh_tokens(db)
+        except Exception:
+            logger.exception("Failed to prune refresh tokens")
+
+
+async def revoke_refresh_token(token: str) -> None:
+    """Revoke the family of a refresh token, which logs out the session
+    that started with it. Access tokens already issued stay valid until
+    they expire."""
+    family = (
+        sqlalchemy.select(refresh_tokens_table.c.family_id)
+        .where(refresh_tokens_table.c.token_hash == hash_refresh_token(token))
+        .scalar_subquery()
+    )
+    query = refresh_tokens_table.update().where(refresh_tokens_table.c.family_id == family).values(revoked=True)
+
+    logger.debug(query)
+
+    await database.execute(query)
+
+
+class PasswordHasher:
+    """Runs bcrypt on its own pool of BCRYPT_MAX_WORKERS threads, so a login
+    no longer holds up the event loop for the 100 ms or more a hash takes.
+    bcrypt releases the GIL while hashing, which lets the threads hash in
+    parallel. Beyond the size of the pool, calls wait their turn; the
+    counters below tell how many do and for how long."""
+
+    def __init__(self, max_workers: int) -> None:
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        # Only touched from the event loop.
+        self.in_flight = 0
+        self.completed = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    @property
+    def queued(self) -> int:
+        return max(self.in_flight - self.max_workers, 0)
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        submitted = time.perf_counter()
+
+        def timed() -> tuple[float, Any]:
+            return time.perf_counter() - submitted, func(*args)
+
+        self.in_flight += 1
+        try:
+            wait, result = await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            self.in_flight -= 1
+
+        self.completed += 1
+        self.total_wait_seconds += wait
+        self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        logger.debug("Password hashing waited %.3f s for a worker", wait)
+
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "completed": self.completed,
+            "average_wait_seconds": self.total_wait_seconds / self.completed if self.completed else 0.0,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
+
+
+password_hasher = PasswordHasher(config.BCRYPT_MAX_WORKERS)
+
+
+def log_auth_stats() -> None:
+    """One log line with the counters of the password hashing pool and of
+    the user and token caches, which the JSON log file keeps as fields."""
+    stats = {
+        "password_hashing": password_hasher.stats(),
+        "user_cache": user_cache.stats(),
+        "token_cache": token_cache.stats(),
+    }
+    logger.info("Authentication stats: %s", stats, extra=stats)
+
+
+async def log_auth_stats_forever(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        log_auth_stats()
+
+
+def _hash_password(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=rounds)).decode()
+
+
+def _check_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password.encode("utf-8"), hashed_password.encode("utf-8"))
 
 
-async def get_user(email: str):
+async def get_password_hash(password: str) -> str:
+    return await password_hasher.run(_hash_password, password, config.BCRYPT_ROUNDS)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.run(_check_password, plain_password, hashed_password)
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Whether the hash was made with another cost than BCRYPT_ROUNDS; the
+    cost is the second field of $2b$12$<salt and hash>."""
+    try:
+        rounds = int(hashed_password.split("$")[2])
+    except (IndexError, ValueError):
+        return True
+
+    return rounds != config.BCRYPT_ROUNDS
+
+
+async def rehash_password(user_id: int, password: str) -> None:
+    logger.debug("Rehashing password", extra={"user_id": user_id})
+
+    query = (
+        users_table.update()
+        .where(users_table.c.id == user_id)
+        .values(password=await get_password_hash(password))
+    )
+
+    logger.debug(query)
+
+    await database.execute(query)
+
+
+async def get_user(email: str, db: Optional[Database] = None):
+    """Look the user up on a read replica unless a database is given;
+    callers that are about to act on a fresh answer pass the primary."""
     logger.debug("Fetching user from the database", extra={"email": email})
 
     query = users_table.select().where(users_table.c.email == email)
 
     logger.debug(query)
 
-    result = await database.fetch_one(query)
+    result = await (db or get_read_database()).fetch_one(query)
 
     if not result:
         return None
@@ -98,23 +403,41 @@ async def get_user(email: str):
 
 async def authenticate_user(email: str, password: str):
     logger.debug("Authenticating user", extra={"email": email})
-    user = await get_user(email)
+    user = await get_user(email, database)
 
     if not user:
         raise create_credentials_exception("Incorrect email or password")
     
-    if not verify_password(password, user.password):
+    if not await verify_password(password, user.password):
         raise create_credentials_exception("Incorrect email or password")
 
     if not user.confirmed:
         raise create_credentials_exception("User has not confirmed email")
 
+    # The password is only known here, so this is where hashes made with an
+    # older cost are brought up to date.
+    if password_needs_rehash(user.password):
+        await rehash_password(user.id, password)
+
     return user
 
 
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
 
-    email = get_subject_for_token_type(token, "access")
+    claims = get_claims_for_token_type(token, "access")
+    email = claims["sub"]
+
+    # Tokens issued without the claims, before the mode was switched on,
+    # still go through the lookup.
+    if config.AUTH_CLAIMS_ONLY and "uid" in claims:
+        if not claims.get("confirmed"):
+            raise create_credentials_exception("User has not confirmed email")
+
+        return User(id=claims["uid"], email=email)
+
+    user = user_cache.get(email)
+    if user:
+        return user
 
     user = await get_user(email)
 
@@ -124,4 +447,6 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
     if not user.confirmed:
         raise create_credentials_exception("User has not confirmed email")
 
+    user_cache.set(email, user)
+
     return user
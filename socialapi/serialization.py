@@ -0,0 +1,63 @@
+from functools import lru_cache
+from typing import Any, Iterable, Optional
+
+import orjson
+from fastapi import HTTPException, Response, status
+from pydantic import BaseModel
+
+
+class JSONBytesResponse(Response):
+    """JSON response for content that is already encoded, or encodes it
+    with orjson."""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return orjson.dumps(content)
+
+
+@lru_cache()
+def model_fields(model: type[BaseModel]) -> tuple[str, ...]:
+    return tuple(model.model_fields)
+
+
+def parse_fields(fields: Optional[str], model: type[BaseModel]) -> tuple[str, ...]:
+    """Fields requested with a comma separated fields= parameter, all of
+    model when there is none."""
+    if fields is None:
+        return model_fields(model)
+
+    requested = tuple(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+    unknown = set(requested) - set(model_fields(model))
+    if not requested or unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}" if unknown else "No fields requested"
+        )
+
+    return requested
+
+
+def row_to_dict(row, fields: Iterable[str]) -> dict:
+    """The fields taken straight from the driver's record.
+
+    This skips validating rows into models and dumping them again, which
+    is safe only for queries whose columns already have the JSON types of
+    the model: integers, strings and nulls, labelled with the field names."""
+    record = row._mapping
+    return {field: record[field] for field in fields}
+
+
+def rows_to_json(rows: Iterable, fields: Iterable[str]) -> bytes:
+    return orjson.dumps([row_to_dict(row, fields) for row in rows])
+
+
+def json_response(content: Any, response: Optional[Response] = None, status_code: int = status.HTTP_200_OK) -> Response:
+    """Return content as is. Headers set on the response FastAPI injected
+    into the endpoint are carried over, as FastAPI drops them once the
+    endpoint returns a response of its own."""
+    rendered = JSONBytesResponse(content, status_code=status_code)
+    if response is not None:
+        rendered.headers.update(response.headers)
+    return rendered
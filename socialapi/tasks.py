@@ -1,9 +1,12 @@
 import logging
 import httpx
 from .config import config
-from .database import post_table
+from .database import post_table, post_version_seq, follows_table, timelines_table, users_table
 from json import JSONDecodeError
 from databases import Database
+from .events import notify
+import sqlalchemy
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 
 logger = logging.getLogger(__name__)
@@ -105,7 +108,8 @@ async def generate_and_add_to_post(
     query = (
         post_table.update()
         .where(post_table.c.id == post_id)
-        .values(image_url=response["output_url"])
+        .values(image_url=response["output_url"], version=post_version_seq.next_value())
+        .returning(notify("post_updated", post_id=post_table.c.id, image_url=post_table.c.image_url))
     )
 
     logger.debug(query)
@@ -123,3 +127,62 @@ async def generate_and_add_to_post(
         ),
     )
     return response
+
+
+async def fan_out_posts(user_id: int, post_ids: list[int], database: Database):
+    """Copy new posts of a user into the timelines of their followers.
+    Accounts above TIMELINE_FANOUT_MAX_FOLLOWERS are skipped; their
+    followers pull those posts in when reading their timeline. Nothing
+    retries a fan-out lost with its worker (see config.py)."""
+    logger.debug("Fanning out posts %s of user %s", post_ids, user_id)
+
+    followers = (
+        sqlalchemy.select(follows_table.c.follower_id, post_table.c.id)
+        .join(users_table, users_table.c.id == follows_table.c.followee_id)
+        .join(post_table, post_table.c.user_id == follows_table.c.followee_id)
+        .where(
+            follows_table.c.followee_id == user_id,
+            users_table.c.follower_count <= config.TIMELINE_FANOUT_MAX_FOLLOWERS,
+            post_table.c.id.in_(post_ids)
+        )
+    )
+    query = (
+        pg_insert(timelines_table)
+        .from_select(["user_id", "post_id"], followers)
+        .on_conflict_do_nothing()
+    )
+
+    logger.debug(query)
+
+    await database.execute(query)
+
+
+async def backfill_timelines(user_id: int, database: Database):
+    """Copy the recent posts of a user into the timelines of all their
+    followers, once the user is back under TIMELINE_FANOUT_MAX_FOLLOWERS.
+    Posts written while above it were never fanned out and are no longer
+    pulled in at read time. Only the last TIMELINE_BACKFILL_POSTS posts
+    come back, as when following someone."""
+    logger.debug("Backfilling timelines of the followers of user %s", user_id)
+
+    recent_posts = (
+        sqlalchemy.select(post_table.c.id)
+        .where(post_table.c.user_id == user_id)
+        .order_by(post_table.c.id.desc())
+        .limit(config.TIMELINE_BACKFILL_POSTS)
+        .subquery("recent_posts")
+    )
+    followers = (
+        sqlalchemy.select(follows_table.c.follower_id, recent_posts.c.id)
+        .join_from(follows_table, recent_posts, sqlalchemy.true())
+        .where(follows_table.c.followee_id == user_id)
+    )
+    query = (
+        pg_insert(timelines_table)
+        .from_select(["user_id", "post_id"], followers)
+        .on_conflict_do_nothing()
+    )
+
+    logger.debug(query)
+
+    await database.execute(query)
@@ -6,6 +6,9 @@ from httpx import AsyncClient, Request, Response
 from unittest.mock import AsyncMock, Mock
 
 from ..database import database, users_table, engine, metadata
+from ..ranking import most_liked_index
+from ..rate_limit import login_email_limiter, login_ip_limiter
+from ..security import token_cache, user_cache
 from ..main import app, prefix_users
 from .helpers import create_post
 
@@ -38,6 +41,12 @@ async def db() -> AsyncGenerator:
     await database.execute(query=query)
     query = """ALTER SEQUENCE likes_id_seq RESTART WITH 1"""
     await database.execute(query=query)
+
+    await most_liked_index.load(database)
+    user_cache.clear()
+    token_cache.clear()
+    login_email_limiter.clear()
+    login_ip_limiter.clear()
     
     yield database
 
@@ -1,10 +1,19 @@
 from httpx import AsyncClient
 from ..main import prefix_posts
+from ..database import database, users_table
+from .. import security
+
+async def create_liker_token(index: int) -> str:
+    email = f"liker{index}@test.com"
+    query = users_table.select().where(users_table.c.email == email)
+    if not await database.fetch_one(query):
+        await database.execute(users_table.insert().values(email=email, password="", confirmed=True))
+    return security.create_access_token(email)
 
 async def create_post(body: str, async_client: AsyncClient, logged_in_token: str, with_likes=0) -> dict:
     response = await async_client.post(prefix_posts + "/create_post", json={"body": body}, headers={"Authorization": f"Bearer {logged_in_token}"})
     for i in range(with_likes):
-        response_like = await async_client.post(prefix_posts + "/like", json={"post_id": response.json()["id"]}, headers={"Authorization": f"Bearer {logged_in_token}"})
+        response_like = await async_client.post(prefix_posts + "/like", json={"post_id": response.json()["id"]}, headers={"Authorization": f"Bearer {await create_liker_token(i)}"})
     return response.json()
 
 async def create_comment(body: str, post_id: int, async_client: AsyncClient, logged_in_token: str) -> dict:
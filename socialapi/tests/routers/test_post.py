@@ -1,11 +1,21 @@
+import asyncio
 import pytest
 from httpx import AsyncClient
+import json
+from databases import Database
 import sys
+from typing import Optional
 from fastapi import status
 from ... import security
+from ...config import config
+from ...database import database, connection_string, post_table, like_table, timelines_table
+from ...like_buffer import LikeBuffer
+from ...events import EventBroker
+from ...ranking import most_liked_index
+from ...pagination import encode_cursor
 
-from ...main import prefix_posts
-from ..helpers import create_post, create_comment, like_post
+from ...main import prefix_posts, prefix_users
+from ..helpers import create_post, create_comment, like_post, create_liker_token
 
 
 
@@ -72,6 +82,20 @@ async def test_create_posts(async_client: AsyncClient, confirmed_user: dict, log
     assert {"id": 3, "body": body, "user_id": confirmed_user["id"], "image_url": None}.items() <= response.json().items()
 
 
+@pytest.mark.anyio
+async def test_create_post_claims_only(async_client: AsyncClient, confirmed_user: dict, logged_in_token: str, mocker):
+    mocker.patch.object(config, "AUTH_CLAIMS_ONLY", True)
+    get_user = mocker.spy(security, "get_user")
+
+    response = await async_client.post(
+        prefix_posts + "/create_post", json={"body": "Test Post"}, headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["user_id"] == confirmed_user["id"]
+    get_user.assert_not_called()
+
+
 @pytest.mark.anyio
 async def test_create_post_without_body(async_client: AsyncClient, logged_in_token: str):
     response = await async_client.post(
@@ -125,21 +149,66 @@ async def test_like_post(async_client: AsyncClient, created_post: list[dict], co
     print()
     print(response.json())
 
-    assert response.status_code == status.HTTP_201_CREATED
-    assert {"id": 2, "post_id": created_post[0]["id"], "user_id": confirmed_user["id"]}.items() <= response.json().items()
+    assert response.status_code == status.HTTP_200_OK
+    assert {"id": 1, "post_id": created_post[0]["id"], "user_id": confirmed_user["id"]}.items() <= response.json().items()
 
 
     response = await async_client.post(
         prefix_posts + "/like", 
         json={"post_id": created_post[0]["id"]},
-        headers={"Authorization": f"Bearer {logged_in_token}"}
+        headers={"Authorization": f"Bearer {await create_liker_token(0)}"}
     )
 
     print()
     print(response.json())
 
     assert response.status_code == status.HTTP_201_CREATED
-    assert {"id": 3, "post_id": created_post[0]["id"], "user_id": confirmed_user["id"]}.items() <= response.json().items()
+    assert {"id": 3, "post_id": created_post[0]["id"]}.items() <= response.json().items()
+
+
+@pytest.mark.anyio
+async def test_like_missing_post(async_client: AsyncClient, logged_in_token: str):
+    response = await async_client.post(
+        prefix_posts + "/like",
+        json={"post_id": 555},
+        headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.anyio
+async def test_unlike_post(async_client: AsyncClient, created_post_with_like: list[dict]):
+    post_id = created_post_with_like[0]["id"]
+    token = await create_liker_token(0)
+
+    response = await async_client.delete(f"{prefix_posts}/like/{post_id}", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+
+    response = await async_client.get(f"{prefix_posts}/{post_id}")
+
+    assert response.json()["post"]["likes"] == 0
+
+    response = await async_client.delete(f"{prefix_posts}/like/{post_id}", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.anyio
+async def test_like_post_updates_like_count(async_client: AsyncClient, created_post: list[dict], logged_in_token: str):
+    await like_post(created_post[0]["id"], async_client, logged_in_token)
+    await like_post(created_post[0]["id"], async_client, logged_in_token)
+    await like_post(created_post[0]["id"], async_client, await create_liker_token(0))
+
+    query = post_table.select().where(post_table.c.id == created_post[0]["id"])
+    post = await database.fetch_one(query)
+
+    assert post.like_count == 2
+
+    response = await async_client.get(f"{prefix_posts}/{created_post[0]['id']}")
+
+    assert response.json()["post"]["likes"] == 2
 
 
 @pytest.mark.anyio
@@ -216,7 +285,7 @@ async def test_get_all_posts_all_posts_with_sort_likes_manual(async_client: Asyn
     await create_post("Test Post 2", async_client, logged_in_token)
     await create_post("Test Post 3", async_client, logged_in_token)
     await like_post(2, async_client, logged_in_token)
-    await like_post(2, async_client, logged_in_token)
+    await like_post(2, async_client, await create_liker_token(0))
     await like_post(3, async_client, logged_in_token)
 
     response = await async_client.get(
@@ -231,6 +300,101 @@ async def test_get_all_posts_all_posts_with_sort_likes_manual(async_client: Asyn
     assert [post["id"] for post in response.json()] == [2, 3, 1]
 
 
+async def collect_pages(
+    async_client: AsyncClient, params: dict, url: str = prefix_posts + "/", headers: Optional[dict] = None
+) -> list[list[dict]]:
+    """Every page of a paginated endpoint, following X-Next-Cursor."""
+    pages = []
+    while True:
+        response = await async_client.get(url, params=params, headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        pages.append(response.json())
+        if "x-next-cursor" not in response.headers:
+            return pages
+        params = {**params, "cursor": response.headers["x-next-cursor"]}
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("sorting", ["new", "old", "most_likes"])
+async def test_get_all_posts_paginated(async_client: AsyncClient, created_posts_with_like: list[dict], sorting: str, number_of_posts_to_test: int):
+
+    response = await async_client.get(prefix_posts + "/", params={"sorting": sorting})
+    assert "x-next-cursor" not in response.headers
+
+    pages = await collect_pages(async_client, {"sorting": sorting, "limit": 2})
+
+    print()
+    print(pages)
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [post["id"] for page in pages for post in page] == [post["id"] for post in response.json()]
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_paginated_most_likes_ties(async_client: AsyncClient, created_posts: list[dict], logged_in_token: str):
+    await like_post(1, async_client, logged_in_token)
+
+    pages = await collect_pages(async_client, {"sorting": "most_likes", "limit": 2})
+
+    assert [post["id"] for page in pages for post in page] == [1, 5, 4, 3, 2]
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_most_likes_without_index(async_client: AsyncClient, created_posts_with_like: list[dict], mocker):
+    mocker.patch.object(most_liked_index, "loaded", False)
+
+    pages = await collect_pages(async_client, {"sorting": "most_likes", "limit": 2})
+
+    assert [post["likes"] for page in pages for post in page] == [5, 4, 3, 2, 1]
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_invalid_cursor(async_client: AsyncClient, created_posts: list[dict]):
+    response = await async_client.get(prefix_posts + "/", params={"cursor": "not a cursor"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "url, params, position",
+    [
+        ("/", {}, {"id": 1e20}),
+        ("/", {}, {"id": 99999999999}),
+        ("/", {}, {"id": 1.5}),
+        ("/", {"sorting": "old"}, {"id": 99999999999}),
+        ("/", {"sorting": "most_likes"}, {"likes": 1, "id": 99999999999}),
+        ("/", {"sorting": "most_likes"}, {"likes": 1.5, "id": 1}),
+        ("/", {"sorting": "most_likes"}, {"likes": True, "id": 1}),
+        ("/search", {"q": "pytest"}, {"rank": 0.5, "id": 99999999999}),
+        ("/search", {"q": "pytest"}, {"rank": 0.5, "id": 1e20}),
+        ("/search", {"q": "pytest"}, {"rank": "0.5", "id": 1}),
+    ],
+)
+async def test_get_posts_invalid_cursor_values(
+    async_client: AsyncClient, created_posts: list[dict], url: str, params: dict, position: dict
+):
+    response = await async_client.get(prefix_posts + url, params={**params, "cursor": encode_cursor(position)})
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json() == {"detail": "Invalid cursor"}
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "url, params, position",
+    [
+        ("/", {"sorting": "most_likes"}, {"likes": 2**31 - 1, "id": 2**31 - 1}),
+        ("/search", {"q": "pytest"}, {"rank": 0.5, "id": 2**31 - 1}),
+    ],
+)
+async def test_get_posts_cursor_at_integer_limit(
+    async_client: AsyncClient, created_posts: list[dict], url: str, params: dict, position: dict
+):
+    response = await async_client.get(prefix_posts + url, params={**params, "cursor": encode_cursor(position)})
+
+    assert response.status_code == status.HTTP_200_OK
+
+
 @pytest.mark.anyio
 async def test_get_all_post_wrong_sorting(async_client: AsyncClient):
     response = await async_client.get(prefix_posts + "/", params={"sorting": "wrong"})
@@ -342,6 +506,19 @@ async def test_get_post_with_many_comments(async_client: AsyncClient, created_po
     assert response.json() == {"post": {**created_post[0], "likes": 0}, "comments": created_comments}
 
 
+@pytest.mark.anyio
+async def test_get_post_with_comments_single_query(async_client: AsyncClient, created_post: list[dict], created_comments: list[dict], mocker):
+    fetch_one = mocker.spy(database, "fetch_one")
+    fetch_all = mocker.spy(database, "fetch_all")
+
+    response = await async_client.get(f"{prefix_posts}/{created_post[0]['id']}")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["comments"] == created_comments
+    assert fetch_one.call_count == 1
+    assert fetch_all.call_count == 0
+
+
 @pytest.mark.anyio
 async def test_get_missing_post_with_comment(async_client: AsyncClient, created_post: list[dict], created_comment: list[dict]):
     response = await async_client.get(
@@ -353,3 +530,555 @@ async def test_get_missing_post_with_comment(async_client: AsyncClient, created_
 
     assert response.status_code == status.HTTP_404_NOT_FOUND
 
+
+
+@pytest.mark.anyio
+async def test_create_posts_batch(async_client: AsyncClient, confirmed_user: dict, logged_in_token: str):
+    response = await async_client.post(
+        prefix_posts + "/create_posts",
+        json=[{"body": "First"}, {"body": "Second"}, {"body": "Third"}],
+        headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    print()
+    print(response.json())
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json() == [
+        {"id": 1, "body": "First", "user_id": confirmed_user["id"], "image_url": None},
+        {"id": 2, "body": "Second", "user_id": confirmed_user["id"], "image_url": None},
+        {"id": 3, "body": "Third", "user_id": confirmed_user["id"], "image_url": None},
+    ]
+
+
+@pytest.mark.anyio
+async def test_create_posts_batch_too_large(async_client: AsyncClient, logged_in_token: str):
+    response = await async_client.post(
+        prefix_posts + "/create_posts",
+        json=[{"body": "Post"}] * 101,
+        headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.anyio
+async def test_create_comments_batch(async_client: AsyncClient, created_posts: list[dict], confirmed_user: dict, logged_in_token: str):
+    response = await async_client.post(
+        prefix_posts + "/create_comments",
+        json=[{"body": "On one", "post_id": 1}, {"body": "On two", "post_id": 2}],
+        headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    print()
+    print(response.json())
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json() == [
+        {"id": 1, "body": "On one", "post_id": 1, "user_id": confirmed_user["id"]},
+        {"id": 2, "body": "On two", "post_id": 2, "user_id": confirmed_user["id"]},
+    ]
+
+
+@pytest.mark.anyio
+async def test_create_comments_batch_missing_post(async_client: AsyncClient, created_post: list[dict], logged_in_token: str):
+    response = await async_client.post(
+        prefix_posts + "/create_comments",
+        json=[{"body": "On one", "post_id": 1}, {"body": "Nowhere", "post_id": 555}],
+        headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert "555" in response.json()["detail"]
+
+    response = await async_client.get(f"{prefix_posts}/{created_post[0]['id']}")
+
+    assert response.json()["comments"] == []
+
+
+@pytest.mark.anyio
+async def test_like_posts_batch(async_client: AsyncClient, created_posts: list[dict], confirmed_user: dict, logged_in_token: str):
+    await like_post(3, async_client, logged_in_token)
+
+    response = await async_client.post(
+        prefix_posts + "/likes",
+        json=[{"post_id": 2}, {"post_id": 3}, {"post_id": 2}],
+        headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    print()
+    print(response.json())
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json() == [
+        {"id": 2, "post_id": 2, "user_id": confirmed_user["id"]},
+        {"id": 1, "post_id": 3, "user_id": confirmed_user["id"]},
+    ]
+
+    response = await async_client.get(prefix_posts + "/", params={"sorting": "most_likes"})
+
+    assert [(post["id"], post["likes"]) for post in response.json()] == [(3, 1), (2, 1), (5, 0), (4, 0), (1, 0)]
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_not_modified(async_client: AsyncClient, created_posts: list[dict], logged_in_token: str):
+    response = await async_client.get(prefix_posts + "/")
+    etag = response.headers["etag"]
+
+    response = await async_client.get(prefix_posts + "/", headers={"If-None-Match": etag})
+
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.headers["etag"] == etag
+
+    await like_post(created_posts[0]["id"], async_client, logged_in_token)
+
+    response = await async_client.get(prefix_posts + "/", headers={"If-None-Match": etag})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["etag"] != etag
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_no_etag_while_writes_run(async_client: AsyncClient, created_posts: list[dict]):
+    # A write holding a version lower than the highest visible one could
+    # commit without changing the ETag. It is still running while a later
+    # write has committed.
+    writer, later_writer = Database(connection_string), Database(connection_string)
+    await writer.connect()
+    await later_writer.connect()
+    try:
+        async with writer.transaction():
+            await writer.execute("SELECT pg_current_xact_id()")
+            async with later_writer.transaction():
+                await later_writer.execute("SELECT pg_current_xact_id()")
+
+            response = await async_client.get(prefix_posts + "/")
+
+            assert response.status_code == status.HTTP_200_OK
+            assert "etag" not in response.headers
+    finally:
+        await writer.disconnect()
+        await later_writer.disconnect()
+
+    response = await async_client.get(prefix_posts + "/")
+
+    assert "etag" in response.headers
+
+
+@pytest.mark.anyio
+async def test_get_post_not_modified(async_client: AsyncClient, created_post: list[dict], logged_in_token: str, mocker):
+    url = f"{prefix_posts}/{created_post[0]['id']}"
+
+    response = await async_client.get(url)
+    etag = response.headers["etag"]
+
+    fetch_one = mocker.spy(database, "fetch_one")
+    response = await async_client.get(url, headers={"If-None-Match": etag})
+
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert fetch_one.call_count == 0
+
+    await create_comment("New comment", created_post[0]["id"], async_client, logged_in_token)
+
+    response = await async_client.get(url, headers={"If-None-Match": etag})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.json()["comments"]) == 1
+    assert response.headers["etag"] != etag
+
+
+@pytest.mark.anyio
+async def test_get_missing_post_if_none_match_any(async_client: AsyncClient):
+    response = await async_client.get(prefix_posts + "/555", headers={"If-None-Match": "*"})
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.anyio
+async def test_export_posts(async_client: AsyncClient, created_posts_with_like: list[dict], mocker):
+    mocker.patch("socialapi.routers.post.EXPORT_CHUNK_SIZE", 2)
+
+    response = await async_client.get(prefix_posts + "/export")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert [post["id"] for post in lines] == [post["id"] for post in created_posts_with_like]
+    assert [post["likes"] for post in lines] == [5, 4, 3, 2, 1]
+
+
+@pytest.mark.anyio
+async def test_get_comments_paginated(async_client: AsyncClient, created_post: list[dict], created_comments: list[dict]):
+    pages = await collect_pages(async_client, {"limit": 2}, f"{prefix_posts}/{created_post[0]['id']}/comments")
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [comment for page in pages for comment in page] == created_comments
+
+
+@pytest.mark.anyio
+async def test_get_comments_missing_post(async_client: AsyncClient):
+    response = await async_client.get(f"{prefix_posts}/555/comments")
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json()["detail"] == "Post not found"
+
+
+@pytest.mark.anyio
+async def test_get_post_with_limited_comments(async_client: AsyncClient, created_post: list[dict], created_comments: list[dict]):
+    url = f"{prefix_posts}/{created_post[0]['id']}"
+
+    response = await async_client.get(url, params={"comments_limit": 3})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["comments"] == created_comments[:3]
+
+    response = await async_client.get(
+        f"{url}/comments",
+        params={"cursor": response.headers["x-next-comments-cursor"]}
+    )
+
+    assert response.json() == created_comments[3:]
+
+    response = await async_client.get(url, params={"comments_limit": 5})
+
+    assert response.json()["comments"] == created_comments
+    assert "x-next-comments-cursor" not in response.headers
+
+
+@pytest.mark.anyio
+async def test_search_posts(async_client: AsyncClient, logged_in_token: str):
+    for body in ["Cats are great", "Dogs and cats, cats everywhere", "Nothing to see here"]:
+        await create_post(body, async_client, logged_in_token)
+
+    response = await async_client.get(prefix_posts + "/search", params={"q": "cat"})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [post["id"] for post in response.json()] == [2, 1]
+    assert "x-next-cursor" not in response.headers
+
+
+@pytest.mark.anyio
+async def test_search_posts_websearch_syntax(async_client: AsyncClient, logged_in_token: str):
+    for body in ["Cats are great", "Dogs and cats, cats everywhere", "Nothing to see here"]:
+        await create_post(body, async_client, logged_in_token)
+
+    response = await async_client.get(prefix_posts + "/search", params={"q": "cats -dogs"})
+
+    assert [post["id"] for post in response.json()] == [1]
+
+
+@pytest.mark.anyio
+async def test_search_posts_paginated(async_client: AsyncClient, created_posts: list[dict], number_of_posts_to_test: int):
+    pages = await collect_pages(async_client, {"q": "pytest", "limit": 2}, prefix_posts + "/search")
+
+    assert [post["id"] for page in pages for post in page] == list(range(number_of_posts_to_test, 0, -1))
+
+
+@pytest.mark.anyio
+async def test_search_posts_requires_query(async_client: AsyncClient):
+    response = await async_client.get(prefix_posts + "/search", params={"q": ""})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+async def follow(async_client: AsyncClient, user_id: int, logged_in_token: str):
+    await async_client.post(prefix_users + f"/{user_id}/follow", headers={"Authorization": f"Bearer {logged_in_token}"})
+
+
+@pytest.mark.anyio
+async def test_get_timeline(async_client: AsyncClient, logged_in_token: str):
+    followed_token, other_token = await create_liker_token(0), await create_liker_token(1)
+    await follow(async_client, 2, logged_in_token)
+
+    await create_post("Followed post", async_client, followed_token)
+    await create_post("Other post", async_client, other_token)
+    await create_post("Own post", async_client, logged_in_token)
+    await create_post("Followed post", async_client, followed_token)
+
+    pages = await collect_pages(
+        async_client, {"limit": 2}, prefix_posts + "/timeline", {"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert [[post["id"] for post in page] for page in pages] == [[4, 3], [1]]
+
+
+@pytest.mark.anyio
+async def test_get_timeline_fan_out(async_client: AsyncClient, logged_in_token: str):
+    followed_token = await create_liker_token(0)
+    await follow(async_client, 2, logged_in_token)
+    await create_post("Followed post", async_client, followed_token)
+
+    query = timelines_table.select().where(timelines_table.c.user_id == 1)
+    assert [row.post_id for row in await database.fetch_all(query)] == [1]
+
+
+@pytest.mark.anyio
+async def test_get_timeline_fan_out_on_read(async_client: AsyncClient, logged_in_token: str, mocker):
+    mocker.patch.object(config, "TIMELINE_FANOUT_MAX_FOLLOWERS", 0)
+    followed_token = await create_liker_token(0)
+    await follow(async_client, 2, logged_in_token)
+
+    await create_post("Followed post", async_client, followed_token)
+    await create_post("Own post", async_client, logged_in_token)
+    await create_post("Followed post", async_client, followed_token)
+
+    query = timelines_table.select()
+    assert await database.fetch_all(query) == []
+
+    pages = await collect_pages(
+        async_client, {"limit": 2}, prefix_posts + "/timeline", {"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert [[post["id"] for post in page] for page in pages] == [[3, 2], [1]]
+
+
+@pytest.mark.anyio
+async def test_get_timeline_backfilled_below_fan_out_threshold(async_client: AsyncClient, logged_in_token: str, mocker):
+    mocker.patch.object(config, "TIMELINE_FANOUT_MAX_FOLLOWERS", 1)
+    followed_token, other_token = await create_liker_token(0), await create_liker_token(1)
+    await follow(async_client, 2, logged_in_token)
+    await follow(async_client, 2, other_token)
+    await create_post("Followed post", async_client, followed_token)
+
+    query = timelines_table.select()
+    assert await database.fetch_all(query) == []
+
+    response = await async_client.delete(prefix_users + "/2/follow", headers={"Authorization": f"Bearer {other_token}"})
+
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert [(row.user_id, row.post_id) for row in await database.fetch_all(query)] == [(1, 1)]
+
+
+@pytest.mark.anyio
+async def test_get_timeline_unauthorized(async_client: AsyncClient):
+    response = await async_client.get(prefix_posts + "/timeline")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.fixture
+def buffered_likes(mocker) -> LikeBuffer:
+    buffer = LikeBuffer(max_size=2)
+    mocker.patch.object(config, "LIKE_BUFFER_ENABLED", True)
+    mocker.patch("socialapi.routers.post.like_buffer", buffer)
+    return buffer
+
+
+@pytest.mark.anyio
+async def test_like_post_buffered(async_client: AsyncClient, created_post: list[dict], logged_in_token: str, buffered_likes: LikeBuffer):
+    response = await async_client.post(
+        prefix_posts + "/like", json={"post_id": created_post[0]["id"]}, headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.json() == {"detail": "Like is accepted"}
+    assert await database.fetch_all(like_table.select()) == []
+
+    await buffered_likes.flush(database)
+
+    response = await async_client.get(prefix_posts + "/")
+    assert response.json()[0]["likes"] == 1
+
+
+@pytest.mark.anyio
+async def test_like_post_documents_buffered_response(async_client: AsyncClient):
+    response = await async_client.get("/openapi.json")
+
+    responses = response.json()["paths"][prefix_posts + "/like"]["post"]["responses"]
+    assert responses["202"]["content"]["application/json"]["schema"] == {"$ref": "#/components/schemas/LikeAccepted"}
+    assert set(responses) >= {"200", "201", "202"}
+
+
+@pytest.mark.anyio
+async def test_like_post_buffered_flushes_when_full(async_client: AsyncClient, created_posts: list[dict], logged_in_token: str, buffered_likes: LikeBuffer):
+    for post in created_posts[:2]:
+        await async_client.post(
+            prefix_posts + "/like", json={"post_id": post["id"]}, headers={"Authorization": f"Bearer {logged_in_token}"}
+        )
+
+    assert len(await database.fetch_all(like_table.select())) == 2
+    assert not buffered_likes.full
+
+
+@pytest.mark.anyio
+async def test_like_post_buffer_full_writes_directly(async_client: AsyncClient, created_posts: list[dict], logged_in_token: str, buffered_likes: LikeBuffer):
+    # As when likes keep coming while a flush is writing the previous batch
+    for post in created_posts[:2]:
+        buffered_likes.add(post["id"], 2)
+
+    response = await async_client.post(
+        prefix_posts + "/like", json={"post_id": created_posts[2]["id"]}, headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert [like.post_id for like in await database.fetch_all(like_table.select())] == [created_posts[2]["id"]]
+    assert not buffered_likes.discard(created_posts[2]["id"], 1)
+
+
+@pytest.mark.anyio
+async def test_unlike_post_buffered(async_client: AsyncClient, created_post: list[dict], logged_in_token: str, buffered_likes: LikeBuffer):
+    headers = {"Authorization": f"Bearer {logged_in_token}"}
+    await async_client.post(prefix_posts + "/like", json={"post_id": created_post[0]["id"]}, headers=headers)
+
+    response = await async_client.delete(prefix_posts + f"/like/{created_post[0]['id']}", headers=headers)
+
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert await buffered_likes.flush(database) == 0
+
+
+@pytest.mark.anyio
+async def test_stream_events(async_client: AsyncClient, mocker):
+    broker = EventBroker(queue_size=10)
+    mocker.patch("socialapi.routers.post.event_broker", broker)
+
+    request = asyncio.create_task(async_client.get(prefix_posts + "/events", params={"post_id": 1}))
+    while not broker._subscribers:
+        await asyncio.sleep(0.01)
+
+    broker.dispatch({"type": "comment_created", "post_id": 1, "comment_id": 3, "user_id": 1})
+    broker.dispatch({"type": "comment_created", "post_id": 2, "comment_id": 4, "user_id": 1})
+    await broker.stop()
+
+    response = await request
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.text == (
+        "event: comment_created\n"
+        'data: {"type": "comment_created", "post_id": 1, "comment_id": 3, "user_id": 1}\n\n'
+    )
+
+
+@pytest.mark.anyio
+async def test_stream_events_while_reconnecting(async_client: AsyncClient, mocker):
+    mocker.patch.object(EventBroker, "reconnecting", new_callable=mocker.PropertyMock, return_value=True)
+
+    response = await async_client.get(prefix_posts + "/events")
+
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["retry-after"] == "1"
+
+
+@pytest.mark.anyio
+async def test_write_endpoints_notify_in_their_statement(async_client: AsyncClient, created_post: list[dict], logged_in_token: str, mocker):
+    # Notifications only go out on commit, which the rolled back test
+    # database never does; see test_events for their delivery.
+    spies = [mocker.spy(database, method) for method in ("fetch_one", "fetch_all", "execute")]
+    headers = {"Authorization": f"Bearer {logged_in_token}"}
+
+    await create_comment("Comment", created_post[0]["id"], async_client, logged_in_token)
+    await like_post(created_post[0]["id"], async_client, logged_in_token)
+    await async_client.delete(prefix_posts + f"/like/{created_post[0]['id']}", headers=headers)
+
+    statements = {
+        event_type: str(call.args[0])
+        for spy in spies
+        for call in spy.call_args_list
+        if "pg_notify" in str(call.args[0])
+        for event_type in call.args[0].compile().params.values()
+        if event_type in ("comment_created", "post_liked", "post_unliked")
+    }
+    assert set(statements) == {"comment_created", "post_liked", "post_unliked"}
+    # The like, its count and its event are a single statement.
+    assert "INSERT INTO likes" in statements["post_liked"] and "UPDATE posts" in statements["post_liked"]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("sorting", ["new", "most_likes"])
+async def test_get_all_posts_fields(async_client: AsyncClient, created_posts_with_like: list[dict], sorting: str, mocker):
+    mocker.patch.object(most_liked_index, "loaded", False)
+
+    response = await async_client.get(
+        prefix_posts + "/", params={"sorting": sorting, "fields": "body,likes", "body_length": 4, "limit": 2}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    expected_likes = [5, 4] if sorting == "most_likes" else [1, 2]
+    assert response.json() == [{"body": "Auto", "likes": likes} for likes in expected_likes]
+    assert "x-next-cursor" in response.headers
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_fields_skip_likes(async_client: AsyncClient, created_posts: list[dict], mocker):
+    fetch_all = mocker.spy(database, "fetch_all")
+
+    response = await async_client.get(prefix_posts + "/", params={"fields": "id"})
+
+    assert response.json() == [{"id": post["id"]} for post in reversed(created_posts)]
+    assert "like_count" not in str(fetch_all.call_args.args[0])
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_unknown_fields(async_client: AsyncClient):
+    response = await async_client.get(prefix_posts + "/", params={"fields": "id,password"})
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["detail"] == "Unknown fields: password"
+
+
+@pytest.mark.anyio
+async def test_get_comments_fields(async_client: AsyncClient, created_post: list[dict], created_comments: list[dict]):
+    response = await async_client.get(prefix_posts + f"/{created_post[0]['id']}/comments", params={"fields": "body", "limit": 2})
+
+    assert response.json() == [{"body": "Auto created comment from pytest"}] * 2
+    assert "x-next-cursor" in response.headers
+
+
+@pytest.mark.anyio
+async def test_get_post_with_comments_fields(async_client: AsyncClient, created_post: list[dict], created_comments: list[dict]):
+    response = await async_client.get(
+        prefix_posts + f"/{created_post[0]['id']}",
+        params={"fields": "id,likes", "comment_fields": "user_id", "comments_limit": 2}
+    )
+
+    assert response.json() == {"post": {"id": 1, "likes": 0}, "comments": [{"user_id": 1}] * 2}
+    assert "x-next-comments-cursor" in response.headers
+
+
+@pytest.mark.anyio
+async def test_get_posts_batch(async_client: AsyncClient, created_posts_with_like: list[dict], mocker):
+    fetch_all = mocker.spy(database, "fetch_all")
+
+    response = await async_client.get(prefix_posts + "/batch", params={"ids": "3,1,555,3,2"})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        "posts": [
+            {"post": {**created_posts_with_like[i], "likes": 5 - i}, "comments": []}
+            for i in (2, 0, 1)
+        ],
+        "missing": [555]
+    }
+    assert fetch_all.call_count == 1
+
+
+@pytest.mark.anyio
+async def test_get_posts_batch_with_comments(async_client: AsyncClient, created_posts: list[dict], logged_in_token: str, mocker):
+    comments = {
+        post_id: [await create_comment(f"Comment {i}", post_id, async_client, logged_in_token) for i in range(3)]
+        for post_id in (1, 2)
+    }
+    fetch_all = mocker.spy(database, "fetch_all")
+
+    response = await async_client.get(
+        prefix_posts + "/batch", params={"ids": "2,4,1", "comments_limit": 2, "fields": "id"}
+    )
+
+    assert response.json() == {
+        "posts": [
+            {"post": {"id": 2}, "comments": comments[2][:2]},
+            {"post": {"id": 4}, "comments": []},
+            {"post": {"id": 1}, "comments": comments[1][:2]},
+        ],
+        "missing": []
+    }
+    assert fetch_all.call_count == 2
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "ids", ["", "1,a", ",", "0", "1,-2", "1,99999999999", ",".join(str(i) for i in range(1, 302))]
+)
+async def test_get_posts_batch_invalid_ids(async_client: AsyncClient, ids: str):
+    response = await async_client.get(prefix_posts + "/batch", params={"ids": ids})
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
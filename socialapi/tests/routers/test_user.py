@@ -3,7 +3,13 @@ from httpx import AsyncClient
 import sys
 from fastapi import status, BackgroundTasks
 
+from ...config import config
 from ...main import prefix_users
+from ...rate_limit import login_email_limiter
+from ... import security
+from ...security import user_cache
+from ...database import database, users_table, timelines_table, refresh_tokens_table
+from ..helpers import create_liker_token, create_post
 
 
 async def register_user(async_client: AsyncClient, email: str, password: str):
@@ -68,6 +74,17 @@ async def test_confirm_user(async_client: AsyncClient, mocker):
     assert "User is confirmed" in response.json()["detail"]
 
 
+@pytest.mark.anyio
+async def test_confirm_user_invalidates_cache(async_client: AsyncClient, mocker):
+    spy = mocker.spy(BackgroundTasks, "add_task")
+    await register_user(async_client, "test@test.com", "1234")
+    user_cache.set("test@test.com", "stale")
+
+    await async_client.get(str(spy.call_args[1]["confirmation_url"]))
+
+    assert user_cache.get("test@test.com") is None
+
+
 @pytest.mark.anyio
 async def test_confirm_user_twice(async_client: AsyncClient, mocker):
     spy = mocker.spy(BackgroundTasks, "add_task")
@@ -86,6 +103,32 @@ async def test_confirm_user_twice(async_client: AsyncClient, mocker):
     assert "User already confirmed" in response.json()["detail"]
 
 
+@pytest.mark.anyio
+async def test_confirm_user_single_query(async_client: AsyncClient, registered_user: dict, mocker):
+    fetch_one = mocker.spy(database, "fetch_one")
+    execute = mocker.spy(database, "execute")
+    token = security.create_confirmation_token(registered_user["email"])
+
+    response = await async_client.get(prefix_users + f"/confirm/{token}")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert fetch_one.call_count == 1
+    execute.assert_not_called()
+
+    query = users_table.select().where(users_table.c.id == registered_user["id"])
+    assert (await database.fetch_one(query)).confirmed
+
+
+@pytest.mark.anyio
+async def test_confirm_user_not_exists(async_client: AsyncClient):
+    token = security.create_confirmation_token("missing@test.com")
+
+    response = await async_client.get(prefix_users + f"/confirm/{token}")
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["detail"] == "User doesn't exist"
+
+
 @pytest.mark.anyio
 async def test_confirm_user_invalid_token(async_client: AsyncClient):
     response = await async_client.get(prefix_users + "/confirm/invalid_token")
@@ -127,6 +170,50 @@ async def test_login_user(async_client: AsyncClient, confirmed_user: dict):
     assert response.status_code == status.HTTP_200_OK
 
 
+@pytest.mark.anyio
+async def test_login_user_rehashes_password(async_client: AsyncClient, confirmed_user: dict, mocker):
+    query = users_table.select().where(users_table.c.id == confirmed_user["id"])
+    old_hash = (await database.fetch_one(query)).password
+    mocker.patch.object(config, "BCRYPT_ROUNDS", 5)
+
+    response = await async_client.post(
+        prefix_users + "/login",
+        json={"email": confirmed_user["email"], "password": confirmed_user["password"]},
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    new_hash = (await database.fetch_one(query)).password
+    assert old_hash.startswith("$2b$04$")
+    assert new_hash.startswith("$2b$05$")
+
+
+@pytest.mark.anyio
+async def test_login_user_token_claims(async_client: AsyncClient, confirmed_user: dict):
+    tokens = await login(async_client, confirmed_user)
+
+    claims = security.get_claims_for_token_type(tokens["access_token"], "access")
+
+    assert claims["uid"] == confirmed_user["id"]
+    assert claims["confirmed"] is True
+
+
+@pytest.mark.anyio
+async def test_login_user_throttled(async_client: AsyncClient, confirmed_user: dict, mocker):
+    mocker.patch.object(login_email_limiter, "burst", 2)
+    verify_password = mocker.spy(security, "verify_password")
+    wrong = {"email": confirmed_user["email"], "password": "random_string"}
+
+    for _ in range(2):
+        response = await async_client.post(prefix_users + "/login", json=wrong)
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    response = await async_client.post(prefix_users + "/login", json=confirmed_user)
+
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert int(response.headers["retry-after"]) > 0
+    assert verify_password.call_count == 2
+
+
 @pytest.mark.anyio
 async def test_login_user_not_confirmed(async_client: AsyncClient, registered_user: dict):
     response = await async_client.post(
@@ -149,3 +236,181 @@ async def test_login_user_incorrect_password(async_client: AsyncClient, register
         },
     )
     assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+async def follow(async_client: AsyncClient, user_id: int, logged_in_token: str):
+    return await async_client.post(
+        prefix_users + f"/{user_id}/follow", headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+
+async def get_follower_count(user_id: int) -> int:
+    query = users_table.select().where(users_table.c.id == user_id)
+    return (await database.fetch_one(query)).follower_count
+
+
+@pytest.fixture
+async def followee(async_client: AsyncClient, logged_in_token: str) -> int:
+    token = await create_liker_token(0)
+    await create_post("Post before the follow", async_client, token)
+    query = users_table.select().where(users_table.c.email == "liker0@test.com")
+    return (await database.fetch_one(query)).id
+
+
+@pytest.mark.anyio
+async def test_follow_user(async_client: AsyncClient, followee: int, confirmed_user: dict, logged_in_token: str):
+    response = await follow(async_client, followee, logged_in_token)
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert await get_follower_count(followee) == 1
+
+    query = timelines_table.select().where(timelines_table.c.user_id == confirmed_user["id"])
+    assert [row.post_id for row in await database.fetch_all(query)] == [1]
+
+
+@pytest.mark.anyio
+async def test_follow_user_twice(async_client: AsyncClient, followee: int, logged_in_token: str):
+    await follow(async_client, followee, logged_in_token)
+    response = await follow(async_client, followee, logged_in_token)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert await get_follower_count(followee) == 1
+
+
+@pytest.mark.anyio
+async def test_follow_self(async_client: AsyncClient, confirmed_user: dict, logged_in_token: str):
+    response = await follow(async_client, confirmed_user["id"], logged_in_token)
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.anyio
+async def test_follow_missing_user(async_client: AsyncClient, logged_in_token: str):
+    response = await follow(async_client, 42, logged_in_token)
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json()["detail"] == "User not found"
+
+
+@pytest.mark.anyio
+async def test_unfollow_user(async_client: AsyncClient, followee: int, confirmed_user: dict, logged_in_token: str):
+    await follow(async_client, followee, logged_in_token)
+
+    response = await async_client.delete(
+        prefix_users + f"/{followee}/follow", headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert await get_follower_count(followee) == 0
+
+    query = timelines_table.select().where(timelines_table.c.user_id == confirmed_user["id"])
+    assert await database.fetch_all(query) == []
+
+
+@pytest.mark.anyio
+async def test_unfollow_user_not_followed(async_client: AsyncClient, followee: int, logged_in_token: str):
+    response = await async_client.delete(
+        prefix_users + f"/{followee}/follow", headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+async def login(async_client: AsyncClient, user: dict) -> dict:
+    response = await async_client.post(prefix_users + "/login", json={"email": user["email"], "password": user["password"]})
+    return response.json()
+
+
+async def refresh(async_client: AsyncClient, refresh_token: str):
+    return await async_client.post(prefix_users + "/refresh", json={"refresh_token": refresh_token})
+
+
+@pytest.mark.anyio
+async def test_refresh_token(async_client: AsyncClient, confirmed_user: dict, mocker):
+    tokens = await login(async_client, confirmed_user)
+    verify_password = mocker.spy(security, "verify_password")
+
+    response = await refresh(async_client, tokens["refresh_token"])
+
+    assert response.status_code == status.HTTP_200_OK
+    refreshed = response.json()
+    assert refreshed["refresh_token"] != tokens["refresh_token"]
+    assert security.get_subject_for_token_type(refreshed["access_token"], "access") == confirmed_user["email"]
+    verify_password.assert_not_called()
+
+    response = await refresh(async_client, refreshed["refresh_token"])
+
+    assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.anyio
+async def test_refresh_token_reuse_revokes_family(async_client: AsyncClient, confirmed_user: dict):
+    tokens = await login(async_client, confirmed_user)
+    refreshed = (await refresh(async_client, tokens["refresh_token"])).json()
+
+    response = await refresh(async_client, tokens["refresh_token"])
+
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.json()["detail"] == "Refresh token has already been used"
+
+    response = await refresh(async_client, refreshed["refresh_token"])
+
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.json()["detail"] == "Refresh token has been revoked"
+
+
+@pytest.mark.anyio
+async def test_refresh_token_rotation_prunes_used_tokens(async_client: AsyncClient, confirmed_user: dict):
+    refresh_token = (await login(async_client, confirmed_user))["refresh_token"]
+    for _ in range(3):
+        refresh_token = (await refresh(async_client, refresh_token)).json()["refresh_token"]
+
+    rows = await database.fetch_all(refresh_tokens_table.select().order_by(refresh_tokens_table.c.id))
+
+    assert len(rows) == 2
+    assert rows[0].used_at is not None
+    assert rows[1].token_hash == security.hash_refresh_token(refresh_token)
+
+
+@pytest.mark.anyio
+async def test_prune_refresh_tokens(async_client: AsyncClient, confirmed_user: dict, mocker):
+    kept = (await login(async_client, confirmed_user))["refresh_token"]
+    mocker.patch("socialapi.security.refresh_token_expire_minutes", return_value=-1)
+    await login(async_client, confirmed_user)
+
+    assert await security.prune_refresh_tokens(database) == 1
+
+    rows = await database.fetch_all(refresh_tokens_table.select())
+    assert [row.token_hash for row in rows] == [security.hash_refresh_token(kept)]
+
+
+@pytest.mark.anyio
+async def test_refresh_token_expired(async_client: AsyncClient, confirmed_user: dict, mocker):
+    mocker.patch("socialapi.security.refresh_token_expire_minutes", return_value=-1)
+    tokens = await login(async_client, confirmed_user)
+
+    response = await refresh(async_client, tokens["refresh_token"])
+
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.json()["detail"] == "Refresh token has expired"
+
+
+@pytest.mark.anyio
+async def test_refresh_token_invalid(async_client: AsyncClient):
+    response = await refresh(async_client, "random_string")
+
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.json()["detail"] == "Invalid refresh token"
+
+
+@pytest.mark.anyio
+async def test_logout(async_client: AsyncClient, confirmed_user: dict):
+    first_session = await login(async_client, confirmed_user)
+    second_session = await login(async_client, confirmed_user)
+    refreshed = (await refresh(async_client, first_session["refresh_token"])).json()
+
+    response = await async_client.post(prefix_users + "/logout", json={"refresh_token": refreshed["refresh_token"]})
+
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert (await refresh(async_client, refreshed["refresh_token"])).status_code == status.HTTP_401_UNAUTHORIZED
+    assert (await refresh(async_client, second_session["refresh_token"])).status_code == status.HTTP_200_OK
@@ -0,0 +1,44 @@
+from ..cache import TTLCache
+
+
+def test_cache_get_set():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+
+def test_cache_expires(mocker):
+    monotonic = mocker.patch("socialapi.cache.time.monotonic", return_value=100.0)
+    cache = TTLCache(max_size=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=20)
+
+    monotonic.return_value = 115.0
+
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert len(cache) == 1
+
+
+def test_cache_evicts_least_recently_used():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_cache_invalidate():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.invalidate("a")
+    cache.invalidate("missing")
+
+    assert cache.get("a") is None
@@ -0,0 +1,72 @@
+import time
+
+import pytest
+from httpx import AsyncClient
+
+from .. import database as database_module
+from ..database import database, get_read_database, last_write_at
+from ..main import LAST_WRITE_COOKIE, prefix_posts
+
+
+@pytest.fixture
+def replicas(mocker) -> list:
+    replicas = [object(), object()]
+    mocker.patch("socialapi.database.replica_databases", replicas)
+    mocker.patch("socialapi.main.replica_databases", replicas)
+    # The replicas above cannot run queries, so reads stay on the primary.
+    mocker.patch("socialapi.routers.post.get_read_database", return_value=database)
+    mocker.patch("socialapi.security.get_read_database", return_value=database)
+    return replicas
+
+
+def test_get_read_database_without_replicas():
+    assert get_read_database() is database
+
+
+def test_get_read_database_round_robin(replicas: list):
+    picked = {get_read_database() for _ in range(4)}
+    assert picked == set(replicas)
+
+
+def test_get_read_database_after_recent_write(replicas: list):
+    token = last_write_at.set(time.time())
+    try:
+        assert get_read_database() is database
+    finally:
+        last_write_at.reset(token)
+
+
+def test_get_read_database_after_old_write(replicas: list):
+    token = last_write_at.set(time.time() - database_module.config.READ_YOUR_WRITES_SECONDS - 1)
+    try:
+        assert get_read_database() in replicas
+    finally:
+        last_write_at.reset(token)
+
+
+@pytest.mark.anyio
+async def test_write_sets_last_write_cookie(async_client: AsyncClient, logged_in_token: str, replicas: list):
+    response = await async_client.post(
+        prefix_posts + "/create_post",
+        json={"body": "Test Post"},
+        headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert response.status_code == 201
+    assert float(response.cookies[LAST_WRITE_COOKIE]) <= time.time()
+
+
+@pytest.mark.anyio
+async def test_read_does_not_set_last_write_cookie(async_client: AsyncClient, replicas: list):
+    response = await async_client.get(prefix_posts + "/")
+
+    assert response.status_code == 200
+    assert LAST_WRITE_COOKIE not in response.cookies
+
+
+@pytest.mark.anyio
+async def test_failed_write_does_not_set_last_write_cookie(async_client: AsyncClient, replicas: list):
+    response = await async_client.post(prefix_posts + "/create_post", json={"body": "Test Post"})
+
+    assert response.status_code == 401
+    assert LAST_WRITE_COOKIE not in response.cookies
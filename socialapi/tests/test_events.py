@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+import sqlalchemy
+from databases import Database
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from ..database import connection_string
+from ..events import EventBroker, notify
+
+
+@pytest.fixture
+def broker() -> EventBroker:
+    return EventBroker(queue_size=2)
+
+
+async def notify_posts_created(database: Database, post_ids: list[int]) -> None:
+    post_id = sqlalchemy.func.unnest(sqlalchemy.cast(post_ids, ARRAY(sqlalchemy.Integer))).column_valued("post_id")
+    await database.fetch_all(sqlalchemy.select(notify("post_created", post_id=post_id)))
+
+
+def test_dispatch(broker: EventBroker):
+    with broker.subscribe() as first, broker.subscribe() as second:
+        broker.dispatch({"type": "post_created", "post_id": 1})
+
+        assert first.get_nowait() == second.get_nowait() == {"type": "post_created", "post_id": 1}
+
+
+def test_dispatch_drops_events_of_slow_subscriber(broker: EventBroker):
+    with broker.subscribe() as queue:
+        for post_id in range(3):
+            broker.dispatch({"type": "post_created", "post_id": post_id})
+
+        assert queue.qsize() == 2
+
+
+def test_unsubscribe(broker: EventBroker):
+    with broker.subscribe() as queue:
+        pass
+
+    broker.dispatch({"type": "post_created", "post_id": 1})
+
+    assert queue.empty()
+
+
+@pytest.mark.anyio
+async def test_stop_ends_streams(broker: EventBroker):
+    with broker.subscribe() as queue:
+        for post_id in range(3):
+            broker.dispatch({"type": "post_created", "post_id": post_id})
+        await broker.stop()
+
+        assert [queue.get_nowait() for _ in range(3)][-1] is None
+
+
+@pytest.mark.anyio
+async def test_notify_reaches_listener(broker: EventBroker):
+    # Notifications are only delivered on commit, which the rolled back
+    # test database never does.
+    committing = Database(connection_string)
+    await committing.connect()
+    await broker.start(connection_string)
+    try:
+        with broker.subscribe() as queue:
+            await notify_posts_created(committing, [1, 2])
+
+            events = [await asyncio.wait_for(queue.get(), 5) for _ in range(2)]
+    finally:
+        await broker.stop()
+        await committing.disconnect()
+
+    assert events == [{"type": "post_created", "post_id": 1}, {"type": "post_created", "post_id": 2}]
+
+
+@pytest.mark.anyio
+async def test_lost_connection_ends_streams_and_reconnects(broker: EventBroker, db: Database, mocker):
+    mocker.patch("socialapi.events.RECONNECT_MIN_SECONDS", 0.01)
+    committing = Database(connection_string)
+    await committing.connect()
+    await broker.start(connection_string)
+    try:
+        with broker.subscribe() as queue:
+            await db.execute(f"SELECT pg_terminate_backend({broker._connection.get_server_pid()})")
+
+            assert await asyncio.wait_for(queue.get(), 5) is None
+            assert broker.reconnecting
+
+        while broker.reconnecting:
+            await asyncio.sleep(0.01)
+
+        with broker.subscribe() as queue:
+            await notify_posts_created(committing, [1])
+
+            event = await asyncio.wait_for(queue.get(), 5)
+    finally:
+        await broker.stop()
+        await committing.disconnect()
+
+    assert event["post_id"] == 1
@@ -0,0 +1,81 @@
+import pytest
+from databases import Database
+from ..database import like_table, post_table
+from ..like_buffer import LikeBuffer
+from ..ranking import most_liked_index
+from .helpers import create_liker_token
+
+
+@pytest.fixture
+def buffer() -> LikeBuffer:
+    return LikeBuffer(max_size=3)
+
+
+async def get_like_count(db: Database, post_id: int) -> int:
+    query = post_table.select().where(post_table.c.id == post_id)
+    return (await db.fetch_one(query)).like_count
+
+
+def test_add_deduplicates(buffer: LikeBuffer):
+    assert buffer.add(1, 1)
+    assert not buffer.add(1, 1)
+    assert buffer.add(1, 2)
+    assert not buffer.full
+    assert buffer.add(2, 1)
+    assert buffer.full
+
+
+def test_discard(buffer: LikeBuffer):
+    buffer.add(1, 1)
+
+    assert buffer.discard(1, 1)
+    assert not buffer.discard(1, 1)
+
+
+@pytest.mark.anyio
+async def test_flush(db: Database, buffer: LikeBuffer, created_post: list[dict]):
+    for i in range(3):
+        await create_liker_token(i)
+    for user_id in (2, 3, 4):
+        buffer.add(created_post[0]["id"], user_id)
+
+    assert await buffer.flush(db) == 3
+    assert await get_like_count(db, created_post[0]["id"]) == 3
+    assert most_liked_index.top(1) == [(created_post[0]["id"], 3)]
+    assert await buffer.flush(db) == 0
+
+
+@pytest.mark.anyio
+async def test_flush_skips_existing_likes_and_missing_posts(db: Database, buffer: LikeBuffer, created_post: list[dict]):
+    await db.execute(like_table.insert().values(post_id=created_post[0]["id"], user_id=1))
+    buffer.add(created_post[0]["id"], 1)
+    buffer.add(42, 1)
+
+    assert await buffer.flush(db) == 0
+    assert len(await db.fetch_all(like_table.select())) == 1
+
+
+@pytest.mark.anyio
+async def test_flush_failure_keeps_likes(db: Database, buffer: LikeBuffer, mocker):
+    mocker.patch.object(db, "fetch_all", side_effect=OSError("connection lost"))
+    buffer.add(1, 1)
+
+    assert await buffer.flush(db) == 0
+    assert buffer.discard(1, 1)
+
+
+@pytest.mark.anyio
+async def test_flush_failure_drops_likes_beyond_size(db: Database, buffer: LikeBuffer, mocker):
+    def fail(query):
+        # Likes coming in while the batch is written take the room first.
+        buffer.add(2, 1)
+        buffer.add(2, 2)
+        raise OSError("connection lost")
+
+    mocker.patch.object(db, "fetch_all", side_effect=fail)
+    buffer.add(1, 1)
+    buffer.add(1, 2)
+
+    assert await buffer.flush(db) == 0
+    assert buffer.full
+    assert [buffer.discard(1, 1), buffer.discard(1, 2), buffer.discard(2, 1), buffer.discard(2, 2)] == [True, False, True, True]
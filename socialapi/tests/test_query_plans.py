@@ -0,0 +1,193 @@
+"""EXPLAIN every query the post and security code sends against a seeded
+database and fail when Postgres has to read one of the big tables
+sequentially. Sequential scans are switched off for the planner, so one
+still showing up means no index can serve that query; the planner then
+also likes to walk a whole index only for its order while filtering every
+row, which counts as a sequential scan too."""
+import json
+
+import pytest
+import sqlalchemy
+from databases import Database
+from httpx import AsyncClient
+from sqlalchemy.dialects.postgresql import asyncpg
+
+from ..database import database
+from ..main import prefix_posts, prefix_users
+from ..pagination import encode_cursor
+from ..ranking import most_liked_index
+from ..security import create_confirmation_token, prune_refresh_tokens
+
+
+LARGE_TABLES = {"posts", "comments", "likes", "users", "follows", "timelines", "refresh_tokens"}
+
+SEED_QUERIES = [
+    """INSERT INTO users (email, password, confirmed)
+       SELECT 'seeded' || i || '@test.com', 'x', true FROM generate_series(1, 500) AS i""",
+    "INSERT INTO users (email, password) VALUES ('unconfirmed@test.com', 'x')",
+    """INSERT INTO posts (body, user_id, like_count)
+       SELECT 'Seeded post ' || i, 1 + i % 500, 2 FROM generate_series(1, 5000) AS i""",
+    """INSERT INTO comments (body, post_id, user_id)
+       SELECT 'Seeded comment ' || i, 1 + i % 5000, 1 + i % 500 FROM generate_series(1, 20000) AS i""",
+    """INSERT INTO likes (post_id, user_id)
+       SELECT post_id, user_id FROM generate_series(1, 5000) AS post_id, generate_series(1, 2) AS user_id""",
+    """INSERT INTO follows (follower_id, followee_id)
+       SELECT follower_id, 1 + (follower_id + i) % 500 FROM generate_series(1, 500) AS follower_id, generate_series(1, 20) AS i""",
+    """UPDATE users SET follower_count = (SELECT count(*) FROM follows WHERE followee_id = users.id)""",
+    # One account too big to fan out, followed by the logged in user
+    """UPDATE users SET follower_count = 1000000 WHERE id = 3""",
+    """INSERT INTO timelines (user_id, post_id)
+       SELECT follows.follower_id, posts.id FROM follows JOIN posts ON posts.user_id = follows.followee_id
+       WHERE follows.followee_id <> 3""",
+    """INSERT INTO refresh_tokens (token_hash, family_id, user_id, expires_at)
+       SELECT md5('token' || i), md5('family' || i % 1000), 1 + i % 500, now() + interval '1 day'
+       FROM generate_series(1, 5000) AS i""",
+    "ANALYZE users, posts, comments, likes, follows, timelines, refresh_tokens",
+]
+
+ENDPOINTS = [
+    ("get", prefix_posts + "/", {}),
+    ("get", prefix_posts + "/", {"params": {"sorting": "old"}}),
+    ("get", prefix_posts + "/", {"params": {"sorting": "most_likes"}}),
+    ("get", prefix_posts + "/", {"params": {"sorting": "new", "cursor": encode_cursor({"id": 2500})}}),
+    ("get", prefix_posts + "/export", {}),
+    ("get", prefix_posts + "/search", {"params": {"q": "post 42"}}),
+    ("get", prefix_posts + "/search", {"params": {"q": "post", "cursor": encode_cursor({"rank": 0.06, "id": 2500})}}),
+    ("get", prefix_posts + "/batch", {"params": {"ids": "42,7,43", "comments_limit": 2}}),
+    ("get", prefix_posts + "/42", {}),
+    ("get", prefix_posts + "/42", {"headers": {"If-None-Match": 'W/"post-42-1"'}}),
+    ("get", prefix_posts + "/42/comments", {}),
+    ("get", prefix_posts + "/42/comments", {"params": {"cursor": encode_cursor({"id": 10})}}),
+    ("get", prefix_posts + "/timeline", {}),
+    ("get", prefix_posts + "/timeline", {"params": {"cursor": encode_cursor({"id": 2500})}}),
+    ("post", prefix_posts + "/create_post", {"json": {"body": "Post"}}),
+    ("post", prefix_posts + "/create_posts", {"json": [{"body": "Post"}, {"body": "Post"}]}),
+    ("post", prefix_posts + "/create_comment", {"json": {"body": "Comment", "post_id": 42}}),
+    ("post", prefix_posts + "/create_comments", {"json": [{"body": "Comment", "post_id": 42}, {"body": "Comment", "post_id": 43}]}),
+    ("post", prefix_posts + "/like", {"json": {"post_id": 42}}),
+    ("post", prefix_posts + "/likes", {"json": [{"post_id": 43}, {"post_id": 44}]}),
+    ("delete", prefix_posts + "/like/42", {}),
+    ("post", prefix_users + "/300/follow", {}),
+    ("delete", prefix_users + "/4/follow", {}),
+]
+
+
+def is_full_scan(plan: dict) -> bool:
+    if plan.get("Relation Name") not in LARGE_TABLES:
+        return False
+    if plan["Node Type"] == "Seq Scan":
+        return True
+    return plan["Node Type"] in ("Index Scan", "Index Only Scan") and "Filter" in plan and "Index Cond" not in plan
+
+
+def find_seq_scans(plan: dict) -> list[str]:
+    found = [plan["Relation Name"]] if is_full_scan(plan) else []
+    for child in plan.get("Plans", []):
+        found.extend(find_seq_scans(child))
+    return found
+
+
+async def explain(query) -> dict:
+    compiled = query.compile(dialect=asyncpg.dialect(), compile_kwargs={"render_postcompile": True})
+    args = [compiled.params[name] for name in compiled.positiontup or []]
+
+    connection = database.connection().raw_connection
+    plan = await connection.fetchval("EXPLAIN (FORMAT JSON) " + str(compiled), *args)
+
+    return json.loads(plan)[0]["Plan"]
+
+
+@pytest.fixture
+async def seeded_db(db: Database, confirmed_user: dict) -> Database:
+    for query in SEED_QUERIES:
+        await db.execute(query)
+    await most_liked_index.load(db)
+    await db.execute("SET LOCAL enable_seqscan = off")
+    return db
+
+
+def record_queries(monkeypatch) -> list:
+    queries = []
+
+    def recording(original):
+        def record(query, *args, **kwargs):
+            if isinstance(query, sqlalchemy.sql.ClauseElement):
+                queries.append(query)
+            return original(query, *args, **kwargs)
+        return record
+
+    for method in ("fetch_one", "fetch_all", "fetch_val", "execute", "iterate"):
+        monkeypatch.setattr(database, method, recording(getattr(database, method)))
+
+    return queries
+
+
+@pytest.fixture
+def recorded_queries(monkeypatch) -> list:
+    return record_queries(monkeypatch)
+
+
+async def assert_indexed(queries: list):
+    assert queries
+    for query in queries:
+        plan = await explain(query)
+        assert not find_seq_scans(plan), f"Sequential scan in plan of:\n{query}\n{json.dumps(plan, indent=2)}"
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("method, url, kwargs", ENDPOINTS)
+async def test_post_queries_use_indexes(
+    async_client: AsyncClient, seeded_db: Database, logged_in_token: str, recorded_queries: list, method: str, url: str, kwargs: dict
+):
+    kwargs = {**kwargs, "headers": {"Authorization": f"Bearer {logged_in_token}", **kwargs.get("headers", {})}}
+    response = await getattr(async_client, method)(url, **kwargs)
+
+    assert response.status_code < 400
+
+    await assert_indexed(recorded_queries)
+
+
+@pytest.mark.anyio
+async def test_security_queries_use_indexes(
+    async_client: AsyncClient, seeded_db: Database, confirmed_user: dict, recorded_queries: list
+):
+    response = await async_client.post(prefix_users + "/login", json=confirmed_user)
+
+    assert response.status_code < 400
+
+    await assert_indexed(recorded_queries)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("url", [prefix_users + "/refresh", prefix_users + "/logout"])
+async def test_refresh_token_queries_use_indexes(
+    async_client: AsyncClient, seeded_db: Database, confirmed_user: dict, monkeypatch, url: str
+):
+    response = await async_client.post(prefix_users + "/login", json=confirmed_user)
+    refresh_token = response.json()["refresh_token"]
+    queries = record_queries(monkeypatch)
+
+    response = await async_client.post(url, json={"refresh_token": refresh_token})
+
+    assert response.status_code < 400
+
+    await assert_indexed(queries)
+
+
+@pytest.mark.anyio
+async def test_confirm_email_queries_use_indexes(async_client: AsyncClient, seeded_db: Database, recorded_queries: list):
+    # The token is made here as it would expire while the suite runs.
+    token = create_confirmation_token("unconfirmed@test.com")
+
+    response = await async_client.get(prefix_users + f"/confirm/{token}")
+
+    assert response.status_code < 400
+
+    await assert_indexed(recorded_queries)
+
+
+@pytest.mark.anyio
+async def test_prune_refresh_tokens_queries_use_indexes(seeded_db: Database, recorded_queries: list):
+    await prune_refresh_tokens(seeded_db)
+
+    await assert_indexed(recorded_queries)
@@ -0,0 +1,50 @@
+import pytest
+from databases import Database
+from ..ranking import MostLikedIndex
+from ..database import post_table
+
+
+@pytest.fixture
+def index() -> MostLikedIndex:
+    index = MostLikedIndex()
+    index.loaded = True
+    for post_id, likes in [(1, 0), (2, 3), (3, 1), (4, 3)]:
+        index.set(post_id, likes)
+    return index
+
+
+def test_top(index: MostLikedIndex):
+    assert index.top(10) == [(4, 3), (2, 3), (3, 1), (1, 0)]
+
+
+def test_top_after(index: MostLikedIndex):
+    assert index.top(2, after=(3, 4)) == [(2, 3), (3, 1)]
+
+
+def test_increment_moves_post(index: MostLikedIndex):
+    index.increment(1, 5)
+    assert index.top(1) == [(1, 5)]
+    assert len(index) == 4
+
+
+def test_increment_unknown_post_is_ignored(index: MostLikedIndex):
+    index.increment(99)
+    assert len(index) == 4
+
+
+def test_increment_before_load_is_ignored():
+    index = MostLikedIndex()
+    index.add_post(1)
+    index.increment(1)
+    assert index.top(10) == []
+
+
+@pytest.mark.anyio
+async def test_load(created_post: list[dict], db: Database):
+    await db.execute(post_table.update().values(like_count=7))
+
+    index = MostLikedIndex()
+    await index.load(db)
+
+    assert index.loaded
+    assert index.top(10) == [(created_post[0]["id"], 7)]
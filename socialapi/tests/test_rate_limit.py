@@ -0,0 +1,51 @@
+import pytest
+from fastapi import HTTPException
+
+from ..rate_limit import TokenBucketLimiter, login_email_limiter, login_ip_limiter, throttle_login
+
+
+@pytest.fixture
+def monotonic(mocker):
+    # The shared limiters are only reset by the db fixture of async tests.
+    login_email_limiter.clear()
+    login_ip_limiter.clear()
+    return mocker.patch("socialapi.rate_limit.time.monotonic", return_value=1000.0)
+
+
+def test_bucket_allows_burst_then_refills(monotonic):
+    limiter = TokenBucketLimiter(burst=2, per_minute=6, max_keys=10)
+
+    for _ in range(2):
+        assert limiter.retry_after("a") == 0
+        limiter.take("a")
+
+    assert limiter.retry_after("a") == pytest.approx(10)
+    assert limiter.retry_after("b") == 0
+
+    monotonic.return_value += 10
+
+    assert limiter.retry_after("a") == 0
+
+
+def test_bucket_evicts_least_recently_used(monotonic):
+    limiter = TokenBucketLimiter(burst=1, per_minute=1, max_keys=2)
+    limiter.take("a")
+    limiter.take("b")
+    limiter.take("c")
+
+    assert len(limiter) == 2
+    assert limiter.retry_after("a") == 0
+    assert limiter.retry_after("c") > 0
+
+
+def test_throttle_login(monotonic, mocker):
+    mocker.patch.object(login_email_limiter, "burst", 1)
+    throttle_login("test@test.com", "1.2.3.4")
+
+    with pytest.raises(HTTPException) as exc_info:
+        throttle_login("test@test.com", "1.2.3.4")
+
+    assert exc_info.value.status_code == 429
+    assert exc_info.value.headers == {"Retry-After": "12"}
+
+    throttle_login("other@test.com", "1.2.3.4")
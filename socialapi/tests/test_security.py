@@ -1,3 +1,5 @@
+import asyncio
+import time
 import pytest
 from .. import security
 from ..config import config
@@ -49,6 +51,37 @@ def test_get_subject_for_token_type_expired(mocker):
     assert exc_info.value.detail == "Token has expired"
 
 
+def test_get_subject_for_token_type_cached(mocker):
+    token = security.create_access_token("cached@test.com")
+    decode = mocker.spy(security.jwt, "decode")
+    hits = security.token_cache.hits
+
+    for _ in range(3):
+        assert security.get_subject_for_token_type(token, "access") == "cached@test.com"
+
+    assert decode.call_count == 1
+    assert security.token_cache.hits == hits + 2
+
+    with pytest.raises(security.HTTPException) as exc_info:
+        security.get_subject_for_token_type(token, "confirmation")
+
+    assert exc_info.value.detail == "Incorrect type, expected confirmation"
+
+
+def test_get_subject_for_token_type_cached_until_expiry(mocker):
+    token = security.create_access_token("expiring@test.com")
+    security.get_subject_for_token_type(token, "access")
+    mocker.patch(
+        "socialapi.cache.time.monotonic",
+        return_value=time.monotonic() + security.access_token_expire_minutes() * 60 + 1
+    )
+    decode = mocker.spy(security.jwt, "decode")
+
+    security.get_subject_for_token_type(token, "access")
+
+    assert decode.call_count == 1
+
+
 def test_get_subject_for_token_type_invalid_token():
     token = "invalid token"
     with pytest.raises(security.HTTPException) as exc_info:
@@ -82,9 +115,35 @@ def test_get_subject_for_token_type_wrong_type():
     assert exc_info.value.detail == "Incorrect type, expected access"
 
 
-def test_password_hashes():
+@pytest.mark.anyio
+async def test_password_hashes():
     password = "password"
-    assert security.verify_password(password, security.get_password_hash(password))
+    hashed = await security.get_password_hash(password)
+
+    assert await security.verify_password(password, hashed)
+    assert not await security.verify_password("wrong", hashed)
+    assert not security.password_needs_rehash(hashed)
+
+
+def test_password_needs_rehash(mocker):
+    mocker.patch.object(config, "BCRYPT_ROUNDS", 12)
+
+    assert not security.password_needs_rehash("$2b$12$" + "a" * 53)
+    assert security.password_needs_rehash("$2b$10$" + "a" * 53)
+    assert security.password_needs_rehash("plain")
+
+
+@pytest.mark.anyio
+async def test_password_hasher_queues_beyond_pool_size():
+    hasher = security.PasswordHasher(max_workers=2)
+
+    results = await asyncio.gather(*(hasher.run(security._hash_password, "password", 4) for _ in range(6)))
+
+    assert len(set(results)) == 6
+    stats = hasher.stats()
+    assert stats["completed"] == 6
+    assert stats["in_flight"] == stats["queued"] == 0
+    assert stats["max_wait_seconds"] > 0
 
 
 @pytest.mark.anyio
@@ -132,6 +191,63 @@ async def test_get_current_user(confirmed_user: dict):
     assert user.email == confirmed_user["email"]
 
 
+@pytest.mark.anyio
+async def test_get_current_user_cached(confirmed_user: dict, mocker):
+    token = security.create_access_token(confirmed_user["email"])
+    await security.get_current_user(token)
+    get_user = mocker.spy(security, "get_user")
+
+    user = await security.get_current_user(token)
+
+    assert user.email == confirmed_user["email"]
+    get_user.assert_not_called()
+    assert security.user_cache.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+
+@pytest.mark.anyio
+async def test_get_current_user_unconfirmed_not_cached(registered_user: dict):
+    token = security.create_access_token(registered_user["email"])
+    with pytest.raises(security.HTTPException):
+        await security.get_current_user(token)
+
+    assert len(security.user_cache) == 0
+
+
+@pytest.mark.anyio
+async def test_get_current_user_claims_only(mocker):
+    mocker.patch.object(config, "AUTH_CLAIMS_ONLY", True)
+    get_user = mocker.spy(security, "get_user")
+    token = security.create_access_token("test@test.com", 7, True)
+
+    user = await security.get_current_user(token)
+
+    assert user == security.User(id=7, email="test@test.com")
+    get_user.assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_get_current_user_claims_only_unconfirmed(mocker):
+    mocker.patch.object(config, "AUTH_CLAIMS_ONLY", True)
+    token = security.create_access_token("test@test.com", 7, False)
+
+    with pytest.raises(security.HTTPException) as exc_info:
+        await security.get_current_user(token)
+
+    assert exc_info.value.detail == "User has not confirmed email"
+
+
+@pytest.mark.anyio
+async def test_get_current_user_claims_only_token_without_claims(confirmed_user: dict, mocker):
+    mocker.patch.object(config, "AUTH_CLAIMS_ONLY", True)
+    get_user = mocker.spy(security, "get_user")
+    token = security.create_access_token(confirmed_user["email"])
+
+    user = await security.get_current_user(token)
+
+    assert user.id == confirmed_user["id"]
+    get_user.assert_called_once()
+
+
 @pytest.mark.anyio
 async def test_get_current_user_invalid_token():
     with pytest.raises(security.HTTPException) as exc_info:
@@ -149,3 +265,12 @@ async def test_get_current_user_wrong_token_type(registered_user: dict):
 
     assert exc_info.value.status_code == security.status.HTTP_401_UNAUTHORIZED
     assert exc_info.value.detail == "Incorrect type, expected access"
+
+
+def test_log_auth_stats(caplog):
+    with caplog.at_level("INFO", logger="socialapi.security"):
+        security.log_auth_stats()
+
+    record = caplog.records[-1]
+    assert record.password_hashing["completed"] >= 0
+    assert set(record.user_cache) == set(record.token_cache) == {"size", "hits", "misses"}
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+from fastapi import HTTPException, Response
+
+from ..models import Comment
+from ..serialization import json_response, model_fields, parse_fields, rows_to_json
+
+
+class Row:
+    def __init__(self, **mapping) -> None:
+        self._mapping = mapping
+
+
+def test_rows_to_json_keeps_model_fields():
+    rows = [Row(id=1, body="Comment", post_id=2, user_id=3, rank=0.5)]
+
+    assert json.loads(rows_to_json(rows, model_fields(Comment))) == [{"id": 1, "body": "Comment", "post_id": 2, "user_id": 3}]
+
+
+def test_parse_fields():
+    assert parse_fields(None, Comment) == ("body", "post_id", "id", "user_id")
+    assert parse_fields(" body, id,body ", Comment) == ("body", "id")
+
+
+def test_parse_fields_empty():
+    with pytest.raises(HTTPException) as exc_info:
+        parse_fields(",", Comment)
+
+    assert exc_info.value.detail == "No fields requested"
+
+
+def test_json_response_keeps_headers():
+    injected = Response()
+    injected.headers["X-Next-Cursor"] = "abc"
+
+    response = json_response(b"[]", injected)
+
+    assert response.body == b"[]"
+    assert response.headers["x-next-cursor"] == "abc"
+    assert response.headers["content-type"] == "application/json"
@@ -66,6 +66,9 @@ async def test_generate_and_add_to_post_success(
         status_code=200, json=json_data, request=httpx.Request("POST", "//")
     )
 
+    query = post_table.select().where(post_table.c.id == created_post[0]["id"])
+    created_post_version = (await db.fetch_one(query)).version
+
     await generate_and_add_to_post(
         confirmed_user["email"],
         created_post[0]["id"],
@@ -80,3 +83,4 @@ async def test_generate_and_add_to_post_success(
     updated_post = await db.fetch_one(query)
 
     assert updated_post.image_url == json_data["output_url"]
+    assert updated_post.version > created_post_version